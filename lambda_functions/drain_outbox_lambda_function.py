@@ -0,0 +1,24 @@
+"""
+Main handler module for the outbox lambda function, which runs periodically
+to deliver the emails that the subscribe lambda function enqueued.
+"""
+from typing import Any, Dict
+
+from email_outbox import drain_outbox
+from get_logger import get_logger
+from profiling import profiled
+
+logger = get_logger(__file__)
+
+
+@profiled
+def lambda_handler(event: Any, _: Any) -> Dict[str, Any]:
+    """
+    Delivers all emails waiting in the outbox
+
+    NOTE: event is unused
+    """
+    logger.info(f"Got event: {event}")
+    response: Dict[str, Any] = drain_outbox()
+    logger.info(f"Sending response: {response}")
+    return response
@@ -0,0 +1,244 @@
+"""
+Module with functions to enqueue rendered emails into a durable outbox in s3
+(so that callers don't wait on SMTP) and to drain the outbox by delivering them.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+from hashlib import sha1
+import json
+import os
+from smtplib import (
+    SMTP as SMTPServer,
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPSenderRefused,
+)
+from threading import local
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Set
+from uuid import uuid4
+
+import boto3
+
+from get_logger import get_logger
+from send_email import render_emails, send_rendered_email, smtp_session
+from send_ledger import make_send_key, SendLedger, split_send_key
+
+STORECHECKER_S3_BUCKET: str = os.environ["STORECHECKER_S3_BUCKET"]
+OUTBOX_S3_PREFIX: str = os.environ["OUTBOX_S3_PREFIX"]
+OUTBOX_DEAD_LETTER_S3_PREFIX: str = os.environ["OUTBOX_DEAD_LETTER_S3_PREFIX"]
+OUTBOX_SEND_LEDGER_S3_KEY: str = os.environ["OUTBOX_SEND_LEDGER_S3_KEY"]
+
+logger = get_logger(__file__)
+s3_client = boto3.client("s3")
+
+# per thread, the key of an outbox entry being collected (if any) and functions
+# rendering its emails
+_collecting = local()
+
+
+def _new_outbox_key() -> str:
+    """Makes a unique outbox key that sorts by the time it was made."""
+    return (
+        f'{OUTBOX_S3_PREFIX}{datetime.now().strftime(r"%Y%m%d%H%M%S")}-'
+        f"{uuid4().hex}.json"
+    )
+
+
+def _put_outbox_entry(key: str, emails: List[Dict[str, str]]) -> None:
+    """Stores the rendered emails as an outbox (or dead letter) entry at the key."""
+    s3_client.put_object(
+        Bucket=STORECHECKER_S3_BUCKET, Key=key, Body=json.dumps(emails).encode()
+    )
+
+
+@contextmanager
+def collected_enqueues() -> Iterator[str]:
+    """
+    Context manager in which emails enqueued by this thread are collected into a
+    single outbox entry, which is rendered and stored on exit (unless an error is
+    raised), so that a lock held inside the block isn't held while doing so.
+
+    Yields:
+        the s3 key that the outbox entry will have
+    """
+    _collecting.key = _new_outbox_key()
+    _collecting.renders = []
+    try:
+        yield _collecting.key
+        (key, renders) = (_collecting.key, _collecting.renders)
+    finally:
+        del _collecting.key, _collecting.renders
+    emails: List[Dict[str, str]] = [email for render in renders for email in render()]
+    if emails:
+        _put_outbox_entry(key, emails)
+        logger.info(f"Enqueued {len(emails)} collected emails at {key}.")
+
+
+def enqueue_email(
+    to_addresses: List[str],
+    subject: str,
+    body: str,
+    is_html: bool = False,
+    formatter: Optional[Callable[[str, str], str]] = None,
+) -> Optional[str]:
+    """
+    Renders the same message for all given recipients and stores it in the outbox
+    (or adds it to the entry being collected to be rendered and stored later, see
+    collected_enqueues).
+
+    See send_email.send_email for a description of the arguments.
+
+    Returns:
+        the s3 key of the outbox entry, or None if there were no recipients
+    """
+    if not to_addresses:
+        return None
+    render: Callable[[], List[Dict[str, str]]] = partial(
+        render_emails, to_addresses, subject, body, is_html=is_html, formatter=formatter
+    )
+    if (renders := getattr(_collecting, "renders", None)) is not None:
+        renders.append(render)
+        return _collecting.key
+    emails: List[Dict[str, str]] = render()
+    key: str = _new_outbox_key()
+    _put_outbox_entry(key, emails)
+    logger.info(f'Enqueued {len(emails)} emails with subject "{subject}" at {key}.')
+    return key
+
+
+def list_outbox_keys() -> List[str]:
+    """Lists the s3 keys of all outbox entries, oldest first."""
+    keys: List[str] = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=STORECHECKER_S3_BUCKET, Prefix=OUTBOX_S3_PREFIX
+    ):
+        keys.extend(item["Key"] for item in page.get("Contents", []))
+    return sorted(keys)
+
+
+def is_permanent_failure(error: SMTPException) -> bool:
+    """
+    Whether the error is a permanent (5xx) refusal of the email itself, so that
+    retrying it can't succeed. A refused sender is a problem with the account
+    rather than the email, so it isn't considered permanent.
+    """
+    if isinstance(error, SMTPRecipientsRefused):
+        return all(500 <= code < 600 for (code, _) in error.recipients.values())
+    if isinstance(error, SMTPSenderRefused):
+        return False
+    return isinstance(error, SMTPResponseException) and (500 <= error.smtp_code < 600)
+
+
+def _email_send_key(key: str, email: Dict[str, str]) -> str:
+    """
+    Makes the ledger key of an email of an outbox entry. It depends on the email's
+    content instead of its position, so it stays the same when the entry is
+    rewritten with fewer emails.
+    """
+    digest: str = sha1(json.dumps(email, sort_keys=True).encode()).hexdigest()
+    return make_send_key(key, email["to"], digest[:16])
+
+
+def _deliver_outbox_entry(
+    server: SMTPServer, key: str, ledger: SendLedger, response: Dict[str, Any]
+) -> None:
+    """
+    Sends the emails of an outbox entry that aren't in the ledger, recording each in
+    the ledger, and deletes the entry once none are left to send.
+
+    Emails that are permanently refused are moved to the dead letter prefix. If
+    other emails fail, the entry is rewritten with only those emails so that the
+    next drain retries just them.
+
+    Args:
+        server: the logged-in SMTP server to send through
+        key: the s3 key of the outbox entry
+        ledger: the send ledger of the outbox
+        response: the summary of the drain (see drain_outbox), which is updated
+    """
+    emails: List[Dict[str, str]] = json.load(
+        s3_client.get_object(Bucket=STORECHECKER_S3_BUCKET, Key=key)["Body"]
+    )
+    unsent: List[Dict[str, str]] = []
+    dead: List[Dict[str, str]] = []
+    for email in emails:
+        send_key: str = _email_send_key(key, email)
+        if send_key in ledger:
+            response["emails_skipped"] += 1
+            continue
+        try:
+            send_rendered_email(server, email)
+        except SMTPException as error:
+            if is_permanent_failure(error):
+                logger.error(f'Email to {email["to"]} was refused for good: {error}')
+                dead.append({**email, "error": str(error)})
+            else:
+                logger.error(f'Failed to send email to {email["to"]}: {error}')
+                unsent.append(email)
+            continue
+        ledger.record(send_key)
+        response["emails_sent"] += 1
+    if dead:
+        dead_letter_key: str = (
+            f"{OUTBOX_DEAD_LETTER_S3_PREFIX}{key[len(OUTBOX_S3_PREFIX):]}"
+        )
+        _put_outbox_entry(dead_letter_key, dead)
+        response["emails_dead_lettered"] += len(dead)
+    if not unsent:
+        s3_client.delete_object(Bucket=STORECHECKER_S3_BUCKET, Key=key)
+        response["entries_delivered"].append(key)
+        return
+    if len(unsent) < len(emails):
+        _put_outbox_entry(key, unsent)
+    response["emails_failed"] += len(unsent)
+    response["entries_failed"].append(key)
+
+
+def drain_outbox(
+    session: Callable[[], ContextManager[SMTPServer]] = smtp_session
+) -> Dict[str, Any]:
+    """
+    Delivers all emails in the outbox through a single SMTP session.
+
+    Each outbox entry is deleted once all of its emails have been sent (or were
+    permanently refused). Entries with emails that failed otherwise are left in
+    the outbox with just those emails, to be retried by the next drain, which also
+    skips any emails that a send ledger says were already sent.
+
+    Args:
+        session: function making a context manager that yields a logged-in SMTP
+            server, e.g. SMTPConnection.session to reuse a connection across drains
+
+    Returns:
+        summary of the drain with the entries delivered and the entries that failed
+    """
+    keys: List[str] = list_outbox_keys()
+    response: Dict[str, Any] = {
+        "emails_sent": 0,
+        "emails_skipped": 0,
+        "emails_failed": 0,
+        "emails_dead_lettered": 0,
+        "entries_delivered": [],
+        "entries_failed": [],
+    }
+    if not keys:
+        logger.info("Outbox is empty. No emails to send.")
+        return response
+    ledger: SendLedger = SendLedger.load(OUTBOX_SEND_LEDGER_S3_KEY)
+    try:
+        with session() as server:
+            for key in keys:
+                _deliver_outbox_entry(server, key, ledger, response)
+    finally:
+        ledger.flush()
+    # only sends of entries still in the outbox need to be remembered
+    remaining: Set[str] = set(response["entries_failed"])
+    ledger.retain(lambda send_key: split_send_key(send_key)[0] in remaining)
+    logger.info(
+        f'Sent {response["emails_sent"]} emails from '
+        f'{len(response["entries_delivered"])} outbox entries.'
+    )
+    return response
@@ -7,7 +7,7 @@ from urllib.parse import quote as url_encode
 
 
 def make_link_formatter(
-    base_url: str, slug: Optional[str] = None
+    base_url: str, slug: Optional[str] = None, region: Optional[str] = None
 ) -> Callable[[str, str], str]:
     """
     Makes an email formatting function that will add URLs to email bodies.
@@ -17,6 +17,7 @@ def make_link_formatter(
     Args:
         base_url: the base (parameter-less) email to call the lambda function with
         slug: the slug of the game 
+        region: the region the game is tracked in, if not the default one
 
     Returns:
         function that will take in an email body to format and a recipient and formats
@@ -42,11 +43,14 @@ def make_link_formatter(
         url_with_subscriber: str = f"{base_url}?subscriber={url_encode(recipient)}"
         kwargs["all_games_unsubscribe_link"] = f"{url_with_subscriber}&type=REMOVE"
         if slug is not None:
+            game: str = f"slug={slug}"
+            if region is not None:
+                game += f"&region={url_encode(region)}"
             kwargs["single_game_unsubscribe_link"] = (
-                f'{kwargs["all_games_unsubscribe_link"]}&slug={slug}'
+                f'{kwargs["all_games_unsubscribe_link"]}&{game}'
             )
             kwargs["single_game_subscribe_link"] = (
-                f"{url_with_subscriber}&type=ADD&slug={slug}"
+                f"{url_with_subscriber}&type=ADD&{game}"
             )
         return body.format(**kwargs)
 
@@ -0,0 +1,276 @@
+"""
+Module with local stand-ins for s3, the Algolia search API, and SMTP so that the
+lambda functions' code can be run (e.g. for load tests) without any AWS resources.
+
+NOTE: importing this module fills in any missing environment variables that the
+      lambda modules need, so it must be imported before any of them.
+"""
+from email.message import EmailMessage
+from hashlib import md5
+from io import BytesIO
+import json
+import os
+import random
+from threading import Lock
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from botocore.exceptions import ClientError
+
+LOCAL_ENVIRONMENT: Dict[str, str] = {
+    "AWS_DEFAULT_REGION": "us-west-2",
+    "SENDER_ADDRESS": "storechecker@localhost",
+    "SENDER_PASSWORD": "local",
+    "US_ALGOLIA_ID": "LOCAL",
+    "US_ALGOLIA_KEY": "local",
+    "US_GAMES_INDEX_NAME": "local_games",
+    "STORECHECKER_S3_BUCKET": "local-storechecker",
+    "SUBSCRIBERS_S3_KEY": "subscribers.json",
+    "STATE_S3_KEY": "state.json",
+    "SUBSCRIBE_URL_S3_KEY": "url_of_subscription_lambda.txt",
+    "SUBSCRIBE_LAMBDA_URL": "http://localhost:8080/",
+    "OUTBOX_S3_PREFIX": "outbox/",
+    "OUTBOX_DEAD_LETTER_S3_PREFIX": "outbox_dead_letter/",
+    "SEND_LEDGER_S3_KEY": "send_ledger.json",
+    "OUTBOX_SEND_LEDGER_S3_KEY": "outbox_send_ledger.json",
+}
+for (name, value) in LOCAL_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+import email_outbox  # noqa: E402
+import search_cache  # noqa: E402
+import send_email  # noqa: E402
+import send_ledger  # noqa: E402
+import shop_region  # noqa: E402
+import subscriber_job  # noqa: E402
+import subscriber_state  # noqa: E402
+import update_state  # noqa: E402
+
+
+class LocalS3Client:
+    """In-memory stand-in for the subset of the boto3 s3 client used by the lambdas"""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Creates an empty in-memory s3.
+
+        Args:
+            latency: seconds that each call sleeps for, to imitate round trip time
+        """
+        self.latency: float = latency
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock: Lock = Lock()
+
+    def _call(self, name: str) -> None:
+        """Counts a call and waits for the simulated round trip."""
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_object(
+        self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Gets the object with the given key. Like s3, raises a ClientError with code
+        "304" instead if the object's ETag matches IfNoneMatch.
+        """
+        self._call("get_object")
+        with self._lock:
+            try:
+                body: bytes = self.objects[(Bucket, Key)]
+            except KeyError:
+                raise KeyError(f"No object s3://{Bucket}/{Key}")
+        etag: str = f'"{md5(body).hexdigest()}"'
+        if etag == IfNoneMatch:
+            raise ClientError(
+                {"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject"
+            )
+        return {"Body": BytesIO(body), "ETag": etag}
+
+    def put_object(self, Bucket: str, Key: str, Body: Any) -> Dict[str, Any]:
+        """Stores the given body at the given key."""
+        self._call("put_object")
+        body: bytes = Body.encode() if isinstance(Body, str) else Body
+        with self._lock:
+            self.objects[(Bucket, Key)] = body
+        return {"ETag": f'"{md5(body).hexdigest()}"'}
+
+    def delete_object(self, Bucket: str, Key: str) -> Dict[str, Any]:
+        """Deletes the object with the given key (if it exists)."""
+        self._call("delete_object")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = "") -> Dict[str, Any]:
+        """Lists all objects in the bucket whose key starts with the prefix."""
+        self._call("list_objects_v2")
+        with self._lock:
+            keys: List[str] = sorted(
+                key
+                for (bucket, key) in self.objects
+                if (bucket == Bucket) and key.startswith(Prefix)
+            )
+        return {"Contents": [{"Key": key} for key in keys], "KeyCount": len(keys)}
+
+    def get_paginator(self, operation_name: str) -> "LocalS3Paginator":
+        """Gets a paginator that yields the full listing as a single page."""
+        if operation_name != "list_objects_v2":
+            raise ValueError(f"Local s3 can't paginate {operation_name}.")
+        return LocalS3Paginator(self)
+
+
+class LocalS3Paginator:
+    """Stand-in for a boto3 list_objects_v2 paginator over a LocalS3Client"""
+
+    def __init__(self, client: LocalS3Client):
+        """Creates a paginator over the objects in the given client."""
+        self.client: LocalS3Client = client
+
+    def paginate(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """Yields the single page of the listing."""
+        yield self.client.list_objects_v2(**kwargs)
+
+
+class LocalHTTPResponse:
+    """Stand-in for the parts of urllib3's HTTPResponse used by the lambdas"""
+
+    def __init__(self, status: int, data: bytes):
+        """Creates a response with the given status code and body."""
+        self.status: int = status
+        self.data: bytes = data
+
+
+class LocalAlgoliaPool:
+    """Stand-in for a region's connection pool that answers game searches locally"""
+
+    def __init__(self, games: List[Dict[str, Any]], latency: float = 0.0):
+        """
+        Creates a search API over the given catalog.
+
+        Args:
+            games: hits (with at least "slug", "title" and "lowestPrice") to search
+            latency: seconds that each request sleeps for
+        """
+        self.games: List[Dict[str, Any]] = games
+        self.latency: float = latency
+        self.requests: int = 0
+
+    def request(
+        self, method: str, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> LocalHTTPResponse:
+        """
+        Answers a search with the games whose title contains every query word,
+        ignoring case, accents, and punctuation like Algolia does.
+        """
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        query: str = parse_qs(urlparse(url).query).get("query", [""])[0]
+        words: List[str] = search_cache.fold_text(query).split()
+        hits: List[Dict[str, Any]] = [
+            game
+            for game in self.games
+            if all(word in search_cache.fold_text(game["title"]) for word in words)
+        ]
+        return LocalHTTPResponse(
+            200, json.dumps({"hits": hits, "nbHits": len(hits)}).encode()
+        )
+
+
+class LocalSMTPServer:
+    """Stand-in for smtplib.SMTP that records messages instead of sending them"""
+
+    sent: List[EmailMessage] = []
+    _lock: Lock = Lock()
+
+    def __init__(self, host: str, port: int = 0):
+        """Creates a fake connection to the given host."""
+        self.host: str = host
+        self.port: int = port
+
+    def __enter__(self) -> "LocalSMTPServer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        return None
+
+    def starttls(self, context: Any = None) -> None:
+        """Pretends to start TLS."""
+
+    def login(self, user: str, password: str) -> None:
+        """Pretends to log in."""
+
+    def noop(self) -> Tuple[int, bytes]:
+        """Pretends the connection is healthy."""
+        return (250, b"OK")
+
+    def quit(self) -> None:
+        """Pretends to close the connection."""
+
+    def send_message(self, message: EmailMessage) -> None:
+        """Records the message as sent."""
+        with LocalSMTPServer._lock:
+            LocalSMTPServer.sent.append(message)
+
+
+def make_catalog(number_of_games: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Makes a synthetic catalog of games with unique slugs and random prices."""
+    generator: random.Random = random.Random(seed)
+    return [
+        {
+            "slug": f"local-game-{index}-switch",
+            "title": f"Local Game {index}",
+            "lowestPrice": round(generator.uniform(4.99, 59.99), 2),
+            "boxart": "",
+            "description": f"Synthetic game number {index}",
+        }
+        for index in range(number_of_games)
+    ]
+
+
+def install_local_backends(
+    games: List[Dict[str, Any]],
+    s3_latency: float = 0.0,
+    algolia_latency: float = 0.0,
+) -> LocalS3Client:
+    """
+    Points every lambda module at fresh local stand-ins.
+
+    Args:
+        games: the catalog that the local search API serves
+        s3_latency: seconds that each s3 call sleeps for
+        algolia_latency: seconds that each search request sleeps for
+
+    Returns:
+        the local s3 client, seeded with empty subscriber and update states and
+        send ledgers
+    """
+    s3: LocalS3Client = LocalS3Client(latency=s3_latency)
+    bucket: str = os.environ["STORECHECKER_S3_BUCKET"]
+    s3.objects[(bucket, os.environ["SUBSCRIBERS_S3_KEY"])] = b"{}"
+    s3.objects[(bucket, os.environ["STATE_S3_KEY"])] = b"{}"
+    s3.objects[(bucket, os.environ["SEND_LEDGER_S3_KEY"])] = b"[]"
+    s3.objects[(bucket, os.environ["OUTBOX_SEND_LEDGER_S3_KEY"])] = b"[]"
+    s3.objects[(bucket, os.environ["SUBSCRIBE_URL_S3_KEY"])] = os.environ[
+        "SUBSCRIBE_LAMBDA_URL"
+    ].encode()
+    for module in (
+        email_outbox,
+        send_ledger,
+        subscriber_job,
+        subscriber_state,
+        update_state,
+    ):
+        module.s3_client = s3
+    subscriber_state._cached_json_data = None
+    subscriber_job._this_functions_url = None
+    for region in shop_region.REGIONS.values():
+        region.http = LocalAlgoliaPool(games, latency=algolia_latency)
+    search_cache.search_cache = search_cache.SearchCache()
+    send_email.SMTPServer = LocalSMTPServer
+    LocalSMTPServer.sent = []
+    return s3
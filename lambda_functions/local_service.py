@@ -0,0 +1,32 @@
+"""
+Script that runs the self-hosted service against the stand-ins in local_backends.
+
+Example:
+    python local_service.py --port 8080 --games 50
+"""
+from argparse import ArgumentParser
+import logging
+import sys
+
+import local_backends  # must be imported before any lambda module
+import self_hosted_service
+
+
+def main() -> None:
+    """Installs the local stand-ins and runs the service."""
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0], add_help=False)
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--s3-latency-ms", type=float, default=0.0)
+    parser.add_argument("--algolia-latency-ms", type=float, default=0.0)
+    (args, service_args) = parser.parse_known_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    local_backends.install_local_backends(
+        local_backends.make_catalog(args.games),
+        s3_latency=args.s3_latency_ms / 1000,
+        algolia_latency=args.algolia_latency_ms / 1000,
+    )
+    self_hosted_service.main(service_args)
+
+
+if __name__ == "__main__":
+    main()
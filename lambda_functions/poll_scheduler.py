@@ -0,0 +1,127 @@
+"""
+Module with a class that decides when each game's price should next be checked,
+based on how often and how much its price has changed recently.
+"""
+from datetime import datetime, timedelta
+import os
+from typing import Optional
+
+from get_logger import get_logger
+from update_state import SingleGameUpdateState
+
+TIMESTAMP_FORMAT: str = r"%Y%m%d%H%M%S"
+MIN_POLL_INTERVAL_HOURS: float = float(os.environ.get("MIN_POLL_INTERVAL_HOURS", 3))
+MAX_POLL_INTERVAL_HOURS: float = float(os.environ.get("MAX_POLL_INTERVAL_HOURS", 48))
+INITIAL_POLL_INTERVAL_HOURS: float = float(
+    os.environ.get("INITIAL_POLL_INTERVAL_HOURS", 12)
+)
+
+logger = get_logger(__file__)
+
+
+class PollScheduler:
+    """Class that schedules price checks of each game between min and max intervals"""
+
+    def __init__(
+        self,
+        min_interval_hours: float = MIN_POLL_INTERVAL_HOURS,
+        max_interval_hours: float = MAX_POLL_INTERVAL_HOURS,
+        initial_interval_hours: float = INITIAL_POLL_INTERVAL_HOURS,
+        change_factor: float = 0.5,
+        stable_factor: float = 1.5,
+        volatility_smoothing: float = 0.3,
+        volatility_weight: float = 10.0,
+        due_tolerance_hours: float = 0.5,
+    ):
+        """
+        Creates a new scheduler.
+
+        Args:
+            min_interval_hours: the shortest allowed time between checks of a game
+            max_interval_hours: the longest allowed time between checks of a game
+            initial_interval_hours: the base interval of a game with no history
+            change_factor: multiplies the base interval when the price changed
+            stable_factor: multiplies the base interval when the price didn't change
+            volatility_smoothing: weight of the newest relative price change in the
+                moving average that is the game's volatility
+            volatility_weight: the interval used is the base interval divided by
+                (1 + volatility_weight * volatility)
+            due_tolerance_hours: how long before its next check a game is already
+                considered due. Runs start a little after the hour, so without this
+                a check due a few seconds after a run's start would wait a whole
+                extra run. Should be about half the time between runs.
+        """
+        self.min_interval_hours: float = min_interval_hours
+        self.max_interval_hours: float = max_interval_hours
+        self.initial_interval_hours: float = initial_interval_hours
+        self.change_factor: float = change_factor
+        self.stable_factor: float = stable_factor
+        self.volatility_smoothing: float = volatility_smoothing
+        self.volatility_weight: float = volatility_weight
+        self.due_tolerance_hours: float = due_tolerance_hours
+
+    def is_due(self, state: Optional[SingleGameUpdateState], now: datetime) -> bool:
+        """Whether a game with the given update state should be checked now."""
+        if (state is None) or (state.next_check is None):
+            return True
+        return datetime.strptime(state.next_check, TIMESTAMP_FORMAT) <= (
+            now + timedelta(hours=self.due_tolerance_hours)
+        )
+
+    def _clamp(self, interval_hours: float) -> float:
+        """Clamps the interval between the min and max intervals."""
+        return min(
+            self.max_interval_hours, max(self.min_interval_hours, interval_hours)
+        )
+
+    def schedule(
+        self,
+        previous: Optional[SingleGameUpdateState],
+        checked: SingleGameUpdateState,
+        now: datetime,
+    ) -> SingleGameUpdateState:
+        """
+        Schedules the next check of a game that was just checked.
+
+        Args:
+            previous: the update state of the game before it was checked (if any)
+            checked: the update state made by checking the game (see UpdateJob)
+            now: the time of the check
+
+        Returns:
+            a copy of the checked state with next_check, check_interval_hours,
+            and volatility set
+        """
+        if (previous is None) or (previous.check_interval_hours is None):
+            interval_hours: float = self.initial_interval_hours
+            volatility: float = 0.0 if previous is None else previous.volatility
+        else:
+            interval_hours = previous.check_interval_hours
+            volatility = previous.volatility
+        if previous is not None:
+            price_change: float = abs(checked.lowest_price - previous.lowest_price)
+            relative_change: float = price_change / max(previous.lowest_price, 0.01)
+            volatility = (
+                (1 - self.volatility_smoothing) * volatility
+                + self.volatility_smoothing * relative_change
+            )
+            interval_hours = self._clamp(
+                interval_hours
+                * (self.change_factor if price_change > 0.01 else self.stable_factor)
+            )
+        wait_hours: float = self._clamp(
+            interval_hours / (1 + self.volatility_weight * volatility)
+        )
+        scheduled: SingleGameUpdateState = SingleGameUpdateState(
+            lowest_price=checked.lowest_price,
+            subscribers_up_to_date=checked.subscribers_up_to_date,
+            last_updated=checked.last_updated,
+            next_check=(now + timedelta(hours=wait_hours)).strftime(TIMESTAMP_FORMAT),
+            check_interval_hours=interval_hours,
+            volatility=volatility,
+        )
+        logger.debug(
+            f"Next check in {wait_hours:.1f} hours (base interval "
+            f"{interval_hours:.1f} hours, volatility {volatility:.3f})."
+        )
+        return scheduled
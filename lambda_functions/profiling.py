@@ -0,0 +1,167 @@
+"""
+Module with a decorator that can profile single invocations of a lambda handler.
+
+Profiling is opt-in: it happens only if the PROFILE_INVOCATIONS environment variable
+is set to a true value or if the (directly invoked) event has a true "profile" field.
+When it happens, the cProfile stats and the top tracemalloc allocation sites are
+written to PROFILE_DIRECTORY (and uploaded under PROFILE_S3_PREFIX, if it's set) and
+a compact summary of the hottest functions is logged.
+
+cProfile only sees the thread that enables it, so code that fans work out to worker
+threads should run each worker's work inside profiled_worker, whose profile is then
+merged into that of the invocation.
+"""
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from io import StringIO
+import os
+import pstats
+from threading import Lock
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+
+from get_logger import get_logger
+
+PROFILE_EVENT_FIELD: str = "profile"
+PROFILE_ALL_INVOCATIONS: bool = os.environ.get(
+    "PROFILE_INVOCATIONS", ""
+).lower() in ("1", "true", "yes")
+PROFILE_DIRECTORY: str = os.environ.get("PROFILE_DIRECTORY", "/tmp/profiles")
+PROFILE_S3_PREFIX: Optional[str] = os.environ.get("PROFILE_S3_PREFIX")
+NUMBER_OF_HOT_FUNCTIONS: int = 10
+NUMBER_OF_ALLOCATION_SITES: int = 25
+
+logger = get_logger(__file__)
+
+Handler = Callable[[Any, Any], Any]
+
+# profiles of worker threads during the invocation being profiled (None if none is)
+_worker_profiles: Optional[List[cProfile.Profile]] = None
+_worker_profiles_lock: Lock = Lock()
+
+
+def _should_profile(event: Any) -> bool:
+    """Whether the invocation with the given event should be profiled."""
+    return PROFILE_ALL_INVOCATIONS or (
+        isinstance(event, dict) and bool(event.get(PROFILE_EVENT_FIELD))
+    )
+
+
+@contextmanager
+def profiled_worker() -> Iterator[None]:
+    """
+    Profiles the work done inside the block on a worker thread if an invocation is
+    being profiled, adding it to the invocation's profile when the block exits.
+    """
+    if _worker_profiles is None:
+        yield
+        return
+    profile: cProfile.Profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # another profiler is active on this thread, which already sees the work
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        with _worker_profiles_lock:
+            if _worker_profiles is not None:
+                _worker_profiles.append(profile)
+
+
+def _hot_functions(profile: pstats.Stats) -> List[str]:
+    """Summarizes the functions with the highest cumulative time, one per line."""
+    stats: Dict[Tuple[str, int, str], Tuple[Any, ...]] = profile.stats
+    hottest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        f"{name} ({os.path.basename(file)}:{line}) calls={calls} "
+        f"total={total_time * 1000:.1f}ms cumulative={cumulative_time * 1000:.1f}ms"
+        for ((file, line, name), (_, calls, total_time, cumulative_time, _))
+        in hottest[:NUMBER_OF_HOT_FUNCTIONS]
+    ]
+
+
+def _write_profile(
+    name: str, profile: pstats.Stats, snapshot: tracemalloc.Snapshot
+) -> List[str]:
+    """Writes the profile and allocation sites to disk (and s3) and returns paths."""
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    stem: str = f'{name}_{datetime.now().strftime(r"%Y%m%d%H%M%S%f")}'
+    profile_path: str = os.path.join(PROFILE_DIRECTORY, f"{stem}.prof")
+    profile.dump_stats(profile_path)
+    allocations_path: str = os.path.join(PROFILE_DIRECTORY, f"{stem}_allocations.txt")
+    with open(allocations_path, "w") as file:
+        for statistic in snapshot.statistics("lineno")[:NUMBER_OF_ALLOCATION_SITES]:
+            file.write(f"{statistic}\n")
+    paths: List[str] = [profile_path, allocations_path]
+    if PROFILE_S3_PREFIX is not None:
+        s3_client = boto3.client("s3")
+        for path in paths:
+            s3_client.upload_file(
+                path,
+                os.environ["STORECHECKER_S3_BUCKET"],
+                f"{PROFILE_S3_PREFIX}{os.path.basename(path)}",
+            )
+    return paths
+
+
+def _profile_invocation(handler: Handler, event: Any, context: Any) -> Any:
+    """
+    Calls the handler under cProfile and tracemalloc and reports the results,
+    including the profiles of its workers (see profiled_worker).
+    """
+    global _worker_profiles
+    profile: cProfile.Profile = cProfile.Profile()
+    already_tracing: bool = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    with _worker_profiles_lock:
+        _worker_profiles = []
+    profile.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profile.disable()
+        with _worker_profiles_lock:
+            stats: pstats.Stats = pstats.Stats(
+                profile, *_worker_profiles, stream=StringIO()
+            )
+            _worker_profiles = None
+        snapshot: tracemalloc.Snapshot = tracemalloc.take_snapshot()
+        (_, peak_memory) = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+        try:
+            paths: List[str] = _write_profile(handler.__module__, stats, snapshot)
+        except Exception as error:
+            logger.error(f"Could not write profile of {handler.__module__}: {error}")
+            paths = []
+        logger.info(
+            f"Profiled {handler.__module__} (peak traced memory "
+            f"{peak_memory / 1024:.0f} KiB), written to {paths}. Hottest functions:"
+        )
+        for line in _hot_functions(stats):
+            logger.info(f"    {line}")
+
+
+def profiled(handler: Handler) -> Handler:
+    """
+    Decorates a lambda handler so that invocations can be profiled on demand.
+
+    When profiling is off, the only cost is checking the event for the profile field.
+    """
+
+    @wraps(handler)
+    def wrapper(event: Any, context: Any) -> Any:
+        if not _should_profile(event):
+            return handler(event, context)
+        return _profile_invocation(handler, event, context)
+
+    return wrapper
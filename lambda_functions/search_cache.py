@@ -0,0 +1,206 @@
+"""
+Module with a size-bounded, time-limited cache of game searches that is shared by
+the SEARCH event of the subscribe lambda and by GameShopState's game lookups.
+"""
+from collections import OrderedDict
+import os
+import re
+from threading import Lock
+import time
+from unicodedata import category, normalize
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from get_logger import get_logger
+from shop_region import DEFAULT_REGION, get_region
+
+HIT_FIELDS: Tuple[str, ...] = (
+    "slug",
+    "title",
+    "lowestPrice",
+    "boxart",
+    "description",
+    "horizontalHeaderImage",
+)
+SEARCH_CACHE_SIZE: int = int(os.environ.get("SEARCH_CACHE_SIZE", 256))
+SEARCH_CACHE_TTL_SECONDS: float = float(os.environ.get("SEARCH_CACHE_TTL_SECONDS", 300))
+
+logger = get_logger(__file__)
+
+# (region, normalized query) -> (expiry time, hits, whether hits are all matches)
+CacheKey = Tuple[str, str]
+CacheEntry = Tuple[float, List[Dict[str, Any]], bool]
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes case and whitespace so that equivalent queries share an entry."""
+    return " ".join(query.lower().split())
+
+
+def trim_hit(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """Keeps only the fields of a hit that are used by the UI and GameShopState."""
+    return {field: hit[field] for field in HIT_FIELDS if field in hit}
+
+
+def fold_text(text: str) -> str:
+    """
+    Lowercases text and folds away accents, apostrophes, and symbols (e.g. "Pokémon™"
+    becomes "pokemon" and "Marvel's Spider-Man" becomes "marvels spider man").
+    """
+    # symbols (e.g. "™") are dropped before NFKD would expand them into letters
+    decomposed: str = normalize(
+        "NFKD", "".join(char for char in text if not category(char).startswith("S"))
+    )
+    without_accents: str = "".join(
+        char for char in decomposed if category(char) != "Mn"
+    ).lower()
+    without_apostrophes: str = re.sub(r"['’]", "", without_accents)
+    return " ".join(re.sub(r"[^\w\s]", " ", without_apostrophes).split())
+
+
+def matches_query(hit: Dict[str, Any], query: str) -> bool:
+    """Whether each word of the (folded) query starts a word of the hit's title."""
+    title_words: List[str] = fold_text(hit.get("title", "")).split()
+    return all(
+        any(title_word.startswith(word) for title_word in title_words)
+        for word in fold_text(query).split()
+    )
+
+
+class SearchCache:
+    """Class that is an LRU cache of search results whose entries expire"""
+
+    def __init__(
+        self,
+        max_size: int = SEARCH_CACHE_SIZE,
+        ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Creates an empty cache.
+
+        Args:
+            max_size: the most queries to keep, least recently used are dropped first
+            ttl_seconds: how long a query's results can be reused for
+            clock: function giving the current time in seconds
+        """
+        self.max_size: int = max_size
+        self.ttl_seconds: float = ttl_seconds
+        self.clock: Callable[[], float] = clock
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._lock: Lock = Lock()
+
+    def get(
+        self, region: str, query: str, refine: bool = True
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Gets cached hits of the normalized query, or None if it must be searched.
+
+        If the query itself isn't cached (and refine is True), the hits are filtered
+        from the longest cached prefix of the query whose results weren't truncated
+        by pagination. Since that filter only approximates the search's matching, a
+        refinement without any hits is treated as a miss.
+        """
+        now: float = self.clock()
+        with self._lock:
+            if (entry := self._entries.get((region, query))) is not None:
+                (expiry, hits, _) = entry
+                if expiry > now:
+                    self._entries.move_to_end((region, query))
+                    return hits
+                del self._entries[(region, query)]
+            if not refine:
+                return None
+            best_prefix: Optional[CacheKey] = None
+            for (key, (expiry, _, complete)) in self._entries.items():
+                if (
+                    complete
+                    and (expiry > now)
+                    and (key[0] == region)
+                    and query.startswith(key[1])
+                    and ((best_prefix is None) or (len(key[1]) > len(best_prefix[1])))
+                ):
+                    best_prefix = key
+            if best_prefix is None:
+                return None
+            self._entries.move_to_end(best_prefix)
+            superset: List[Dict[str, Any]] = self._entries[best_prefix][1]
+        refined: List[Dict[str, Any]] = [
+            hit for hit in superset if matches_query(hit, query)
+        ]
+        logger.debug(
+            f'Refined cached results of "{best_prefix[1]}" for "{query}" to '
+            f"{len(refined)} hits."
+        )
+        return refined or None
+
+    def put(
+        self, region: str, query: str, hits: List[Dict[str, Any]], complete: bool
+    ) -> None:
+        """
+        Caches the hits of the normalized query.
+
+        Args:
+            region: the name of the region that was searched
+            query: the normalized query
+            hits: the (trimmed) hits
+            complete: True if hits has every match (i.e. none were paginated away),
+                so that refinements of the query can be filtered from it
+        """
+        with self._lock:
+            self._entries[(region, query)] = (
+                self.clock() + self.ttl_seconds,
+                hits,
+                complete,
+            )
+            self._entries.move_to_end((region, query))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+search_cache: SearchCache = SearchCache()
+
+
+def cached_search(
+    query: str, region: str = DEFAULT_REGION, refine: bool = True
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Searches the region's eShop, reusing cached results where possible.
+
+    Args:
+        query: the text to search for
+        region: the name of the regional eShop to search
+        refine: if False, only cached results of this exact query are reused
+            (see SearchCache.get)
+
+    Returns:
+        (trimmed hits, whether the hits came from the cache)
+    """
+    normalized: str = normalize_query(query)
+    if (hits := search_cache.get(region, normalized, refine=refine)) is not None:
+        return (hits, True)
+    response: Dict[str, Any] = get_region(region).search_response(normalized)
+    hits = [trim_hit(hit) for hit in response["hits"]]
+    search_cache.put(
+        region,
+        normalized,
+        hits,
+        complete=response.get("nbHits", len(hits)) <= len(hits),
+    )
+    return (hits, False)
+
+
+def perform_search(job_spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Performs the search of a SEARCH event of the subscribe lambda.
+
+    NOTE: Requires parameters in event:
+        query: the text to search for
+        region (optional): the name of the regional eShop to search. Defaults to US.
+        exact (optional): if "1" (or "true"), the search isn't refined from the
+            results of a cached shorter query, e.g. when looking up a known game
+    """
+    exact: bool = str(job_spec.get("exact", "")).lower() in ("1", "true")
+    (hits, cached) = cached_search(
+        job_spec["query"], job_spec.get("region", DEFAULT_REGION), refine=not exact
+    )
+    return {"type": "SEARCH", "hits": hits, "cached": cached}
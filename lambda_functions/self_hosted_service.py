@@ -0,0 +1,389 @@
+"""
+Module that runs both lambda functions' logic in a single long-running process:
+an HTTP server with the same semantics as the subscribe lambda's function URL,
+plus background loops for fulfillment, outbox draining, and persistence.
+
+By default, subscriber state is kept in memory and written behind to s3. With a
+batch window, subscribe requests are instead performed in batches that each load
+and save the state in s3 once (see subscribe_batcher). Either way, the s3, Algolia,
+and SMTP clients are kept warm for the lifetime of the process.
+
+Example:
+    python self_hosted_service.py --port 8080 --workers 16
+    python self_hosted_service.py --port 8080 --workers 64 --batch-window-ms 50
+"""
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import signal
+from threading import Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlparse
+
+from email_outbox import collected_enqueues, drain_outbox
+from game_shop_state import GameShopState
+from get_logger import get_logger
+from search_cache import perform_search
+from send_email import SMTPConnection
+from subscribe_batcher import SubscribeBatcher
+from subscribe_lambda_function import detect_call_type
+from subscriber_job import (
+    get_this_functions_url,
+    parse_and_perform_subscriber_job,
+    prefetch_shop_state,
+)
+from subscriber_state import (
+    load_game_subscriber_states_from_s3,
+    save_game_subscriber_states_to_s3,
+    SingleGameSubscriberState,
+)
+from update_lambda_function import run_fulfillment
+
+logger = get_logger(__file__)
+
+
+class SubscriberStateStore:
+    """Class that keeps subscriber state in memory and writes it behind to s3"""
+
+    def __init__(self):
+        """Loads the subscriber state (and the URL used in emails) from s3 once."""
+        self._state: Dict[str, SingleGameSubscriberState] = (
+            load_game_subscriber_states_from_s3()
+        )
+        self._lock: Lock = Lock()
+        self._dirty: bool = False
+        get_this_functions_url()
+
+    def perform(self, job_spec: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs the subscriber job of the given spec on the in-memory state.
+
+        The lock is only held while the state is changed. The game is looked up in
+        the shop before, and the job's emails are rendered and enqueued after.
+        """
+        shop_state: Optional[GameShopState] = prefetch_shop_state(job_spec)
+        with collected_enqueues():
+            with self._lock:
+                try:
+                    response: Dict[str, Any] = parse_and_perform_subscriber_job(
+                        job_spec, self._state, shop_state
+                    )
+                finally:
+                    self._dirty = True
+        return response
+
+    def _copy(self) -> Dict[str, SingleGameSubscriberState]:
+        """Deep copy of the state. NOTE: the lock must be held when calling this."""
+        return {
+            slug: SingleGameSubscriberState(**json.loads(json.dumps(value.dictionary)))
+            for (slug, value) in self._state.items()
+        }
+
+    def snapshot(self) -> Dict[str, SingleGameSubscriberState]:
+        """Gets a copy of the state that is safe to read while jobs are performed."""
+        with self._lock:
+            return self._copy()
+
+    def flush(self) -> bool:
+        """Saves the state to s3 if it changed since the last flush."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            state: Dict[str, SingleGameSubscriberState] = self._copy()
+            self._dirty = False
+        try:
+            save_game_subscriber_states_to_s3(state)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+        return True
+
+
+class WorkerPoolHTTPServer(HTTPServer):
+    """HTTP server that handles each request on a fixed-size pool of worker threads"""
+
+    def __init__(
+        self,
+        server_address: Tuple[str, int],
+        handler_class: Callable[..., BaseHTTPRequestHandler],
+        workers: int,
+    ):
+        """
+        Creates a server bound to the given address.
+
+        Args:
+            server_address: (host, port) to listen on
+            handler_class: the request handler class
+            workers: the number of requests that can be handled at once
+        """
+        super().__init__(server_address, handler_class)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers)
+
+    def _process_request_in_worker(self, request: Any, client_address: Any) -> None:
+        """Handles the request and closes it (same as ThreadingMixIn)."""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        """Hands the request off to the worker pool."""
+        self.executor.submit(self._process_request_in_worker, request, client_address)
+
+    def server_close(self) -> None:
+        """Waits for in-flight requests and closes the socket."""
+        self.executor.shutdown(wait=True)
+        super().server_close()
+
+
+def make_subscribe_request_handler(
+    perform: Callable[[Dict[str, Any]], Dict[str, Any]],
+) -> Callable[..., BaseHTTPRequestHandler]:
+    """
+    Makes a request handler class that performs subscriber jobs with the given
+    function, e.g. SubscriberStateStore.perform or SubscribeBatcher.perform.
+    """
+
+    class SubscribeRequestHandler(BaseHTTPRequestHandler):
+        """Handles GET requests like the subscribe lambda's function URL"""
+
+        def _respond(self, status: int, body: Dict[str, Any]) -> None:
+            """Sends a JSON response."""
+            data: bytes = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            """Performs the job given by the query string (or referer)."""
+            event: Dict[str, Any] = {
+                "queryStringParameters": dict(parse_qsl(urlparse(self.path).query)),
+                "headers": {},
+            }
+            if (referer := self.headers.get("Referer")) is not None:
+                event["headers"]["referer"] = referer
+            logger.info(f"Got event: {event}")
+            try:
+                job_spec: Dict[str, Any] = detect_call_type(event)
+                if job_spec.get("type") == "SEARCH":
+                    response: Dict[str, Any] = perform_search(job_spec)
+                else:
+                    response = perform(job_spec)
+            except (KeyError, ValueError) as error:
+                logger.warning(f"Bad request {self.path}: {error}")
+                self._respond(400, {"error": str(error)})
+                return
+            except Exception as error:
+                logger.exception(f"Failed to handle {self.path}")
+                self._respond(500, {"error": str(error)})
+                return
+            logger.info(f"Sending response: {response}")
+            self._respond(200, response)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            """Sends the access log to the module logger instead of stderr."""
+            logger.debug(format % args)
+
+    return SubscribeRequestHandler
+
+
+def run_periodically(
+    name: str,
+    interval: float,
+    task: Callable[[], Any],
+    stop: Event,
+    run_first: bool = False,
+) -> Thread:
+    """
+    Starts a daemon thread that runs the task every interval seconds until stopped.
+
+    Errors are logged instead of stopping the loop.
+
+    Args:
+        name: the name of the task (and its thread)
+        interval: seconds to wait between runs of the task
+        task: the function to run
+        stop: event that stops the loop when set
+        run_first: whether to also run the task once right away, before waiting
+    """
+
+    def run_task() -> None:
+        try:
+            task()
+        except Exception:
+            logger.exception(f"Periodic task {name} failed.")
+
+    def loop() -> None:
+        if run_first and not stop.is_set():
+            run_task()
+        while not stop.wait(interval):
+            run_task()
+
+    thread: Thread = Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+class SelfHostedService:
+    """Class that runs the subscribe endpoint and the background loops together"""
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        workers: int = 8,
+        fulfillment_interval: float = 3600.0,
+        outbox_interval: float = 60.0,
+        flush_interval: float = 5.0,
+        batch_window: Optional[float] = None,
+        max_batch_size: int = 100,
+    ):
+        """
+        Creates (but doesn't start) the service.
+
+        Args:
+            host: the interface for the HTTP server to listen on
+            port: the port for the HTTP server to listen on
+            workers: the number of requests that can be handled at once
+            fulfillment_interval: seconds between fulfillment runs
+            outbox_interval: seconds between drains of the email outbox
+            flush_interval: seconds between write-behind saves of subscriber state
+            batch_window: if given, seconds that subscribe requests wait to be
+                batched with others instead of using in-memory subscriber state
+            max_batch_size: the most subscribe requests to perform in one batch
+        """
+        self.store: Optional[SubscriberStateStore] = None
+        self.batcher: Optional[SubscribeBatcher] = None
+        if batch_window is None:
+            self.store = SubscriberStateStore()
+            perform: Callable[[Dict[str, Any]], Dict[str, Any]] = self.store.perform
+        else:
+            self.batcher = SubscribeBatcher(batch_window, max_batch_size)
+            perform = self.batcher.perform
+        self.smtp_connection: SMTPConnection = SMTPConnection()
+        self.server: WorkerPoolHTTPServer = WorkerPoolHTTPServer(
+            (host, port), make_subscribe_request_handler(perform), workers
+        )
+        self.intervals: Dict[str, float] = {
+            "fulfillment": fulfillment_interval,
+            "outbox": outbox_interval,
+            "flush": flush_interval,
+        }
+        self._stop: Event = Event()
+        self._threads: List[Thread] = []
+
+    def fulfill(self) -> Dict[str, Any]:
+        """Runs fulfillment over the in-memory (or else the saved) subscriber state."""
+        response: Dict[str, Any] = run_fulfillment(
+            load_game_subscriber_states_from_s3()
+            if self.store is None
+            else self.store.snapshot()
+        )
+        logger.info(f"Fulfillment saved state: {response['saved']}")
+        return response
+
+    def drain_outbox(self) -> Dict[str, Any]:
+        """Delivers enqueued emails over the warm SMTP connection."""
+        return drain_outbox(session=self.smtp_connection.session)
+
+    def start(self) -> None:
+        """
+        Starts the background loops (but not the HTTP server). Fulfillment and
+        outbox draining run once right away, then every interval.
+        """
+        tasks: Dict[str, Callable[[], Any]] = {
+            "fulfillment": self.fulfill,
+            "outbox": self.drain_outbox,
+        }
+        if self.store is not None:
+            tasks["flush"] = self.store.flush
+        if self.batcher is not None:
+            self.batcher.start()
+        # fulfillment and the outbox don't wait a whole interval after a (re)start
+        run_first: Set[str] = {"fulfillment", "outbox"}
+        self._threads = [
+            run_periodically(
+                name,
+                self.intervals[name],
+                task,
+                self._stop,
+                run_first=(name in run_first),
+            )
+            for (name, task) in tasks.items()
+        ]
+
+    def serve_forever(self) -> None:
+        """Starts the background loops and serves HTTP requests until interrupted."""
+        self.start()
+        (host, port) = self.server.server_address[:2]
+        logger.info(f"Serving subscribe endpoint on http://{host}:{port}/")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Interrupted. Shutting down.")
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stops the loops, then finishes in-flight requests and pending writes."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.server.server_close()
+        if self.store is not None:
+            self.store.flush()
+        if self.batcher is not None:
+            self.batcher.stop()
+        self.smtp_connection.close()
+
+
+def parse_args(args: Optional[List[str]] = None) -> Namespace:
+    """Parses the command line arguments."""
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--fulfillment-interval", type=float, default=3600.0)
+    parser.add_argument("--outbox-interval", type=float, default=60.0)
+    parser.add_argument("--flush-interval", type=float, default=5.0)
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        help="batch subscribe requests in windows of this many milliseconds",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=100)
+    return parser.parse_args(args)
+
+
+def _interrupt(signal_number: int, _: Any) -> None:
+    """Turns a termination signal into a KeyboardInterrupt for a graceful shutdown."""
+    raise KeyboardInterrupt(f"Received signal {signal_number}")
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    """Runs the service as configured on the command line."""
+    parsed: Namespace = parse_args(args)
+    signal.signal(signal.SIGTERM, _interrupt)
+    SelfHostedService(
+        host=parsed.host,
+        port=parsed.port,
+        workers=parsed.workers,
+        fulfillment_interval=parsed.fulfillment_interval,
+        outbox_interval=parsed.outbox_interval,
+        flush_interval=parsed.flush_interval,
+        batch_window=(
+            None if parsed.batch_window_ms is None else parsed.batch_window_ms / 1000
+        ),
+        max_batch_size=parsed.max_batch_size,
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 """Module with function that sends plain text email from the sender to any receiver."""
+from contextlib import contextmanager
 from email.message import EmailMessage
 import os
-from smtplib import SMTP as SMTPServer
+from smtplib import SMTP as SMTPServer, SMTPException, SMTPServerDisconnected
 from ssl import create_default_context
-from typing import Callable, List, Optional
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Optional
 
 from get_logger import get_logger
 
@@ -13,12 +15,122 @@ SENDER_PASSWORD: str = os.environ["SENDER_PASSWORD"]
 logger = get_logger(__file__)
 
 
+def render_emails(
+    to_addresses: List[str],
+    subject: str,
+    body: str,
+    is_html: bool = False,
+    formatter: Optional[Callable[[str, str], str]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Renders the same message for each of the given recipients.
+
+    Args:
+        to_addresses: the recipient email addresses
+        subject: subject line of the email
+        body: main message text of the email
+        is_html: True if body string is html, False if it is plain text
+        formatter: optional function that formats the message based on the recipient.
+            If given, the actual body of the message is formatter(body, recipient),
+            where recipient is the specific to_address being messaged.
+
+    Returns:
+        JSON-able rendered emails with "to", "subject", "body", and "subtype" keys
+    """
+    # html bodies keep characters like non-dollar currency symbols as references
+    body = body.encode("ascii", "xmlcharrefreplace" if is_html else "ignore").decode(
+        "ascii"
+    )
+    subtype: str = "html" if is_html else "plain"
+    return [
+        {
+            "to": to_address,
+            "subject": subject,
+            "body": body if formatter is None else formatter(body, to_address),
+            "subtype": subtype,
+        }
+        for to_address in to_addresses
+    ]
+
+
+@contextmanager
+def smtp_session() -> Iterator[SMTPServer]:
+    """Context manager yielding an SMTP server that the sender is logged in to."""
+    context = create_default_context()
+    with SMTPServer("smtp.gmail.com", port=587) as server:
+        server.starttls(context=context)
+        server.login(SENDER_ADDRESS, SENDER_PASSWORD)
+        yield server
+
+
+class SMTPConnection:
+    """Class that keeps a single logged-in SMTP connection open across many uses"""
+
+    def __init__(self):
+        """Creates a connection that is only opened when it's first used."""
+        self._server: Optional[SMTPServer] = None
+        self._lock: Lock = Lock()
+
+    def _open(self) -> SMTPServer:
+        """Opens a new connection and logs the sender in."""
+        server: SMTPServer = SMTPServer("smtp.gmail.com", port=587)
+        server.starttls(context=create_default_context())
+        server.login(SENDER_ADDRESS, SENDER_PASSWORD)
+        return server
+
+    @contextmanager
+    def session(self) -> Iterator[SMTPServer]:
+        """
+        Context manager yielding the open SMTP server, reconnecting if it was dropped.
+
+        Can be used in place of smtp_session, but doesn't log out when exiting.
+        """
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.noop()
+                except (SMTPException, OSError):
+                    logger.info("SMTP connection was dropped. Reconnecting.")
+                    self._server = None
+            if self._server is None:
+                self._server = self._open()
+            try:
+                yield self._server
+            except (SMTPServerDisconnected, OSError):
+                self._server = None
+                raise
+
+    def close(self) -> None:
+        """Logs out and closes the connection if it's open."""
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.quit()
+                except (SMTPException, OSError):
+                    pass
+                self._server = None
+
+
+def send_rendered_email(server: SMTPServer, email: Dict[str, str]) -> None:
+    """Sends a single email made by render_emails through a logged-in SMTP server."""
+    logger.info(
+        f'Sending email to {email["to"]} with subject line "{email["subject"]}".'
+    )
+    message: EmailMessage = EmailMessage()
+    message["Subject"] = email["subject"]
+    message["From"] = SENDER_ADDRESS
+    message["To"] = email["to"]
+    message.set_content(email["body"], email["subtype"])
+    server.send_message(message)
+
+
 def send_email(
     to_addresses: List[str],
     subject: str,
     body: str,
     is_html: bool = False,
     formatter: Optional[Callable[[str, str], str]] = None,
+    on_sent: Optional[Callable[[str], None]] = None,
 ) -> None:
     """
     Sends the same plain text message to all given recipients.
@@ -31,24 +143,18 @@ def send_email(
         formatter: optional function that formats the message based on the recipient.
             If given, the actual body of the message is formatter(body, recipient),
             where recipient is the specific to_address being messaged.
+        on_sent: optional function called with each recipient once their email is
+            sent, e.g. to record the send in a ledger (see send_ledger module)
     """
     if not to_addresses:
         return
-    body = body.encode("ascii", "ignore").decode("ascii")
-    context = create_default_context()
-    subtype: str = "html" if is_html else "plain"
-    with SMTPServer("smtp.gmail.com", port=587) as server:
-        server.starttls(context=context)
-        server.login(SENDER_ADDRESS, SENDER_PASSWORD)
-        for to_address in to_addresses:
-            logger.info(f'Sending email to {to_address} with subject line "{subject}".')
-            message: EmailMessage = EmailMessage()
-            message["Subject"] = subject
-            message["From"] = SENDER_ADDRESS
-            message["To"] = to_address
-            message.set_content(
-                body if formatter is None else formatter(body, to_address), subtype
-            )
-            server.send_message(message)
+    emails: List[Dict[str, str]] = render_emails(
+        to_addresses, subject, body, is_html=is_html, formatter=formatter
+    )
+    with smtp_session() as server:
+        for email in emails:
+            send_rendered_email(server, email)
+            if on_sent is not None:
+                on_sent(email["to"])
 
     return
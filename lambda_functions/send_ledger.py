@@ -0,0 +1,117 @@
+"""
+Module with a ledger of the emails that a run has already sent, stored in s3 as the
+run goes so that a retry of a failed or timed out run can skip those emails.
+"""
+import json
+import os
+from threading import Lock
+from typing import Callable, Iterable, List, Set
+
+import boto3
+
+from get_logger import get_logger
+
+STORECHECKER_S3_BUCKET: str = os.environ["STORECHECKER_S3_BUCKET"]
+SEND_LEDGER_FLUSH_SIZE: int = int(os.environ.get("SEND_LEDGER_FLUSH_SIZE", 20))
+
+logger = get_logger(__file__)
+s3_client = boto3.client("s3")
+
+
+def make_send_key(*parts: str) -> str:
+    """Makes the ledger key of a send, e.g. from its slug, transition, and recipient."""
+    return "|".join(parts)
+
+
+def split_send_key(send_key: str) -> List[str]:
+    """Splits the ledger key of a send back into the parts it was made from."""
+    return send_key.split("|")
+
+
+class SendLedger:
+    """
+    Class that records sends in a JSON list in s3, writing after every few sends
+    (and on flush) instead of after each one.
+    """
+
+    def __init__(
+        self,
+        s3_key: str,
+        sent: Iterable[str] = (),
+        flush_size: int = SEND_LEDGER_FLUSH_SIZE,
+    ):
+        """
+        Creates a ledger.
+
+        Args:
+            s3_key: the key of the ledger object in the store checker bucket
+            sent: the keys of sends that were already recorded
+            flush_size: the number of new sends after which the ledger is written
+        """
+        self.s3_key: str = s3_key
+        self.flush_size: int = flush_size
+        self._sent: Set[str] = set(sent)
+        self._unflushed: int = 0
+        self._lock: Lock = Lock()
+
+    @classmethod
+    def load(cls, s3_key: str) -> "SendLedger":
+        """Loads the ledger stored at the given key from s3."""
+        sent: List[str] = json.load(
+            s3_client.get_object(Bucket=STORECHECKER_S3_BUCKET, Key=s3_key)["Body"]
+        )
+        if sent:
+            logger.info(f"Loaded {len(sent)} sends of an unfinished run from {s3_key}.")
+        return cls(s3_key, sent)
+
+    def __contains__(self, send_key: str) -> bool:
+        """Whether the send with the given key was already recorded."""
+        with self._lock:
+            return send_key in self._sent
+
+    def __len__(self) -> int:
+        """The number of sends recorded."""
+        with self._lock:
+            return len(self._sent)
+
+    def _write(self) -> None:
+        """Writes the ledger to s3. NOTE: the lock must be held when calling this."""
+        s3_client.put_object(
+            Bucket=STORECHECKER_S3_BUCKET,
+            Key=self.s3_key,
+            Body=json.dumps(sorted(self._sent)).encode(),
+        )
+        self._unflushed = 0
+
+    def record(self, send_key: str) -> None:
+        """Records a completed send, writing the ledger if enough are unwritten."""
+        with self._lock:
+            self._sent.add(send_key)
+            self._unflushed += 1
+            if self._unflushed >= self.flush_size:
+                self._write()
+
+    def flush(self) -> None:
+        """Writes any recorded sends that haven't been written yet."""
+        with self._lock:
+            if self._unflushed:
+                self._write()
+
+    def retain(self, keep: Callable[[str], bool]) -> None:
+        """Forgets the recorded sends whose keys don't satisfy keep, writing if any."""
+        with self._lock:
+            kept: Set[str] = {send_key for send_key in self._sent if keep(send_key)}
+            if len(kept) < len(self._sent):
+                logger.info(
+                    f"Pruned {len(self._sent) - len(kept)} sends from {self.s3_key}."
+                )
+                self._sent = kept
+                self._write()
+
+    def clear(self) -> None:
+        """Empties the ledger once its run has finished, writing only if needed."""
+        with self._lock:
+            if self._sent or self._unflushed:
+                self._sent.clear()
+                self._write()
+                logger.info(f"Cleared send ledger {self.s3_key}.")
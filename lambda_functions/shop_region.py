@@ -0,0 +1,200 @@
+"""
+Module with a class that encapsulates a single regional eShop, along with
+a function to fetch games from many regions in parallel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar
+from urllib.parse import quote as url_encode
+
+from urllib3 import HTTPResponse, PoolManager
+
+from get_logger import get_logger
+from profiling import profiled_worker
+
+DEFAULT_REGION: str = "US"
+DEFAULT_REQUEST_BUDGET: int = 200
+
+logger = get_logger(__file__)
+T = TypeVar("T")
+
+
+class RequestBudgetExceeded(RuntimeError):
+    """Error raised when a region has used up its request budget for a run."""
+
+
+class ShopRegion:
+    """Class representing the search API of a single regional eShop"""
+
+    def __init__(
+        self,
+        name: str,
+        algolia_id: str,
+        algolia_key: str,
+        games_index_name: str,
+        request_budget: int = DEFAULT_REQUEST_BUDGET,
+        currency_symbol: str = "$",
+    ):
+        """
+        Initiates a new shop region with its own connection pool.
+
+        Args:
+            name: the unique name of the region (e.g. "US")
+            algolia_id: the ID of the Algolia application that backs this eShop
+            algolia_key: the API key of the Algolia application
+            games_index_name: the name of the Algolia index of games in this eShop
+            request_budget: the maximum number of requests to make per run
+            currency_symbol: the symbol of the currency that this eShop's prices are in
+        """
+        self.name: str = name
+        self.headers: Dict[str, str] = {
+            "Content-Type": "application/json",
+            "X-Algolia-API-Key": algolia_key,
+            "X-Algolia-Application-Id": algolia_id,
+        }
+        self.get_games_base_url: str = (
+            f"https://{algolia_id}-dsn.algolia.net/1/indexes/{games_index_name}"
+        )
+        self.request_budget: int = request_budget
+        self.currency_symbol: str = currency_symbol
+        self.http: PoolManager = PoolManager()
+        self._requests_made: int = 0
+        self._budgeted_runs: int = 0
+        self._lock: Lock = Lock()
+
+    @contextmanager
+    def budgeted_run(self) -> Iterator[None]:
+        """
+        Context manager inside which this region makes at most request_budget
+        requests. Requests made outside of a budgeted run are not limited.
+        """
+        with self._lock:
+            if not self._budgeted_runs:
+                self._requests_made = 0
+            self._budgeted_runs += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._budgeted_runs -= 1
+
+    def _use_request(self) -> None:
+        """Counts a request against the budget, raising an error if it's used up."""
+        with self._lock:
+            if not self._budgeted_runs:
+                return
+            if self._requests_made >= self.request_budget:
+                raise RequestBudgetExceeded(
+                    f"Region {self.name} already made its budget of "
+                    f"{self.request_budget} requests this run."
+                )
+            self._requests_made += 1
+
+    def format_price(self, price: float) -> str:
+        """Formats a price in this region's currency (e.g. "$19.99")."""
+        return f"{self.currency_symbol}{price:.2f}"
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """Gets the hits of the given search query in this region's eShop."""
+        return self.search_response(query)["hits"]
+
+    def search_response(self, query: str) -> Dict[str, Any]:
+        """
+        Gets the full response to the given search query in this region's eShop,
+        including "hits" and "nbHits" (the number of hits before pagination).
+        """
+        self._use_request()
+        url: str = f"{self.get_games_base_url}?query={url_encode(query)}"
+        response: HTTPResponse = self.http.request("GET", url, headers=self.headers)
+        if response.status != 200:
+            logger.error(
+                f"Received bad response {response.status} from {self.name} API call."
+            )
+            logger.debug(f"Response data: {response.data.decode()}")
+        return json.loads(response.data.decode())
+
+
+def _load_regions() -> Dict[str, ShopRegion]:
+    """
+    Loads all regions from the environment.
+
+    The US region is always made from the US_ALGOLIA_* variables. Other regions can
+    be given in the SHOP_REGIONS variable as a JSON object mapping region name to an
+    object with "algolia_id", "algolia_key", "games_index_name", and (optionally)
+    "request_budget" and "currency_symbol" keys.
+    """
+    regions: Dict[str, ShopRegion] = {
+        DEFAULT_REGION: ShopRegion(
+            name=DEFAULT_REGION,
+            algolia_id=os.environ["US_ALGOLIA_ID"],
+            algolia_key=os.environ["US_ALGOLIA_KEY"],
+            games_index_name=os.environ["US_GAMES_INDEX_NAME"],
+            request_budget=int(
+                os.environ.get("US_REQUEST_BUDGET", DEFAULT_REQUEST_BUDGET)
+            ),
+        )
+    }
+    for (name, config) in json.loads(os.environ.get("SHOP_REGIONS", "{}")).items():
+        regions[name] = ShopRegion(name=name, **config)
+    return regions
+
+
+REGIONS: Dict[str, ShopRegion] = _load_regions()
+
+
+def get_region(name: str) -> ShopRegion:
+    """Gets the region with the given name."""
+    try:
+        return REGIONS[name]
+    except KeyError:
+        raise ValueError(
+            f'Region "{name}" is not configured (existing regions: {list(REGIONS)}).'
+        )
+
+
+def fetch_in_parallel(
+    tasks: Sequence[Tuple[str, Callable[[], T]]]
+) -> List[Tuple[bool, Any]]:
+    """
+    Performs fetches with one worker per region, so that regions run in parallel.
+
+    Fetches within a single region run serially, sharing that region's connection
+    pool and a budgeted run of that region's requests.
+
+    Args:
+        tasks: (region name, fetch function) pairs
+
+    Returns:
+        a (success, result) pair for each task in the same order as tasks. If the
+        fetch raised an error, success is False and result is the error.
+    """
+    indices_by_region: Dict[str, List[int]] = {}
+    for (index, (region_name, _)) in enumerate(tasks):
+        indices_by_region.setdefault(region_name, []).append(index)
+    results: List[Tuple[bool, Any]] = [(False, None)] * len(tasks)
+
+    def fetch_region(region_name: str) -> None:
+        """Performs all fetches of a single region in turn."""
+        with profiled_worker():
+            try:
+                region: ShopRegion = get_region(region_name)
+            except ValueError as error:
+                logger.error(str(error))
+                for index in indices_by_region[region_name]:
+                    results[index] = (False, error)
+                return
+            with region.budgeted_run():
+                for index in indices_by_region[region_name]:
+                    try:
+                        results[index] = (True, tasks[index][1]())
+                    except Exception as error:
+                        logger.error(f"Fetch failed in region {region_name}: {error}")
+                        results[index] = (False, error)
+
+    if indices_by_region:
+        with ThreadPoolExecutor(max_workers=len(indices_by_region)) as executor:
+            list(executor.map(fetch_region, indices_by_region))
+    return results
@@ -0,0 +1,171 @@
+"""
+Module with a class that collects concurrent subscribe events into short windows and
+performs each window's events as one batch, with a single load and save of the
+subscriber state, while still giving each caller its own response.
+"""
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Event, Thread
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from email_outbox import collected_enqueues
+from game_shop_state import GameShopState
+from get_logger import get_logger
+from subscriber_job import parse_and_perform_subscriber_jobs, prefetch_shop_state
+from subscriber_state import (
+    load_game_subscriber_states_from_s3,
+    save_game_subscriber_states_to_s3,
+    SingleGameSubscriberState,
+)
+
+logger = get_logger(__file__)
+
+# (job spec, prefetched shop state of the job's game, future of the job's response)
+PendingJob = Tuple[Dict[str, Any], Optional[GameShopState], "Future[Dict[str, Any]]"]
+
+
+class SubscribeBatcher:
+    """Class that performs subscriber jobs in batches on a background thread"""
+
+    def __init__(
+        self,
+        window_seconds: float = 0.05,
+        max_batch_size: int = 100,
+        load: Callable[
+            [], Dict[str, SingleGameSubscriberState]
+        ] = load_game_subscriber_states_from_s3,
+        save: Callable[
+            [Dict[str, SingleGameSubscriberState]], Any
+        ] = save_game_subscriber_states_to_s3,
+    ):
+        """
+        Creates (but doesn't start) a batcher.
+
+        Args:
+            window_seconds: how long to wait for more events after the first event
+                of a batch arrives. Events that arrive while a batch is being
+                performed also join the next batch.
+            max_batch_size: the most events to perform in a single batch
+            load: function loading the subscriber state
+            save: function saving the (modified) subscriber state
+        """
+        self.window_seconds: float = window_seconds
+        self.max_batch_size: int = max_batch_size
+        self.load: Callable[[], Dict[str, SingleGameSubscriberState]] = load
+        self.save: Callable[[Dict[str, SingleGameSubscriberState]], Any] = save
+        self._queue: "Queue[PendingJob]" = Queue()
+        self._stop: Event = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        """Starts the background thread that performs batches."""
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name="subscribe-batcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Performs the events already submitted and stops the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # events submitted just as the thread stopped
+        leftover: List[PendingJob] = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except Empty:
+                break
+        if leftover:
+            self.perform_batch(leftover)
+
+    def submit(
+        self, job_spec: Dict[str, Any], shop_state: Optional[GameShopState] = None
+    ) -> "Future[Dict[str, Any]]":
+        """
+        Queues the job spec for the next batch and returns its future response.
+
+        Args:
+            job_spec: the subscribe event to perform
+            shop_state: the already looked up shop state of the event's game, if any
+                (see subscriber_job.prefetch_shop_state)
+        """
+        if self._stop.is_set():
+            raise RuntimeError("Cannot submit subscriber jobs to a stopped batcher.")
+        future: "Future[Dict[str, Any]]" = Future()
+        self._queue.put((job_spec, shop_state, future))
+        return future
+
+    def perform(self, job_spec: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs the job spec in a batch, waiting for its response.
+
+        The game is looked up in the shop on the calling thread first, so that the
+        lookups of a batch's events happen in parallel instead of one after another
+        on the batcher's thread.
+        """
+        return self.submit(job_spec, prefetch_shop_state(job_spec)).result()
+
+    def _next_batch(self) -> List[PendingJob]:
+        """Waits briefly for an event and then collects the rest of its window."""
+        try:
+            batch: List[PendingJob] = [self._queue.get(timeout=0.1)]
+        except Empty:
+            return []
+        deadline: float = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except Empty:
+                pass
+            if (remaining := deadline - time.monotonic()) <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def perform_batch(self, batch: List[PendingJob]) -> None:
+        """
+        Performs the batch's jobs with one load and save of the subscriber state (and
+        one outbox entry for all of their emails) and resolves each job's future with
+        its own response or error.
+
+        If the state can't be loaded or saved, every job in the batch fails and none
+        of their emails are enqueued.
+        """
+        try:
+            state: Dict[str, SingleGameSubscriberState] = self.load()
+            # saving inside the block means the emails are only enqueued (on exit)
+            # if the state they describe was saved
+            with collected_enqueues():
+                results: List[Tuple[bool, Any]] = parse_and_perform_subscriber_jobs(
+                    [job_spec for (job_spec, _, _) in batch],
+                    state,
+                    shop_states=[shop_state for (_, shop_state, _) in batch],
+                )
+                if any(success for (success, _) in results):
+                    self.save(state)
+        except Exception as error:
+            logger.exception(f"Failed to perform batch of {len(batch)} events.")
+            for (_, _, future) in batch:
+                future.set_exception(error)
+            return
+        logger.info(
+            f"Performed batch of {len(batch)} events "
+            f"({sum(not success for (success, _) in results)} failed)."
+        )
+        for ((_, _, future), (success, result)) in zip(batch, results):
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    def _run(self) -> None:
+        """Performs batches until stopped and no submitted events remain."""
+        while not (self._stop.is_set() and self._queue.empty()):
+            if batch := self._next_batch():
+                self.perform_batch(batch)
@@ -1,11 +1,14 @@
 """
 Main handler module for the subscribe lambda function, which can be
-used to add subscribers, remove subscribers, or add games.
+used to add subscribers, remove subscribers, add games, or search for games.
 """
 from typing import Any, Dict, List
 from urllib.parse import unquote as decode_url
 
+from email_outbox import collected_enqueues
 from get_logger import get_logger
+from profiling import profiled
+from search_cache import perform_search
 from subscriber_job import parse_and_perform_subscriber_job
 from subscriber_state import (
     load_game_subscriber_states_from_s3,
@@ -53,15 +56,29 @@ def detect_call_type(event: Dict[str, Any]) -> Dict[str, Any]:
         return args
 
 
+@profiled
 def lambda_handler(event: Dict[str, Any], _: Any) -> Dict[str, Any]:
-    """Performs a SubscriberJob (see subscribe_job module) loaded from input event."""
+    """
+    Performs a SubscriberJob (see subscribe_job module) loaded from input event,
+    or a cached game search (see search_cache module) if the event type is SEARCH.
+    """
     logger.info(f"Got event: {event}")
     job_spec: Dict[str, Any] = detect_call_type(event)
+    if job_spec.get("type") == "SEARCH":
+        # searches don't touch subscriber state, so they skip loading and saving it
+        response: Dict[str, Any] = perform_search(job_spec)
+        logger.info(
+            f'Sending {len(response["hits"])} hits (cached: {response["cached"]})'
+        )
+        return response
     state: Dict[str, SingleGameSubscriberState] = load_game_subscriber_states_from_s3()
-    response: Dict[str, Any] = parse_and_perform_subscriber_job(job_spec, state)
-    current_subscriptions: Dict[str, Dict[str, Any]] = (
-        save_game_subscriber_states_to_s3(state)
-    )
+    # the job's emails are only enqueued (on exit) once the state they describe is
+    # saved, so a retry after a failed save doesn't send them twice
+    with collected_enqueues():
+        response = parse_and_perform_subscriber_job(job_spec, state)
+        current_subscriptions: Dict[str, Dict[str, Any]] = (
+            save_game_subscriber_states_to_s3(state)
+        )
     logger.info(f"Current subscriptions: {current_subscriptions}")
     logger.info(f"Sending response: {response}")
     return response
@@ -0,0 +1,269 @@
+"""
+Script that replays recorded or synthetic subscribe events against the subscribe
+lambda function (running over the stand-ins in local_backends) at a configurable
+concurrency and reports latency percentiles, throughput, and lost updates.
+
+With --batch-window-ms, the events are instead performed in batches through a
+SubscribeBatcher, as in the batched mode of self_hosted_service.
+
+Example:
+    python subscribe_load_test.py --requests 500 --concurrency 16 --s3-latency-ms 30
+    python subscribe_load_test.py --requests 500 --concurrency 64 --batch-window-ms 20
+"""
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote as url_encode
+
+import local_backends  # must be imported before any lambda module
+from subscribe_batcher import SubscribeBatcher
+import subscribe_lambda_function
+from subscriber_state import load_game_subscriber_states_from_s3
+
+EVENT_SHAPES: Tuple[str, ...] = ("direct", "url", "referer")
+
+
+def shape_event(job_spec: Dict[str, str], shape: str) -> Dict[str, Any]:
+    """
+    Wraps a job spec in one of the event shapes understood by detect_call_type.
+
+    Args:
+        job_spec: the string parameters of the subscriber job (type, subscriber, ...)
+        shape: "direct" for a direct invocation, "url" for a function URL call with
+            query parameters, or "referer" for a function URL call whose parameters
+            are only in the referer header
+
+    Returns:
+        the event to give to the lambda handler
+    """
+    if shape == "direct":
+        return dict(job_spec)
+    elif shape == "url":
+        return {"queryStringParameters": dict(job_spec), "headers": {}}
+    elif shape == "referer":
+        query: str = "&".join(
+            f"{name}={url_encode(value)}" for (name, value) in job_spec.items()
+        )
+        return {
+            "queryStringParameters": {},
+            "headers": {"referer": f"https://localhost/?{query}"},
+        }
+    else:
+        raise ValueError(f'Unknown event shape "{shape}" (known: {EVENT_SHAPES}).')
+
+
+def make_synthetic_events(
+    catalog: List[Dict[str, Any]],
+    number_of_requests: int,
+    number_of_subscribers: int,
+    shape: str,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Makes ADD events of random subscribers to random games in the catalog.
+
+    Args:
+        catalog: the games that can be subscribed to
+        number_of_requests: the number of events to make
+        number_of_subscribers: the number of distinct subscriber addresses to use
+        shape: event shape (see shape_event) or "mixed" to pick one at random
+        seed: the seed of the random number generator
+
+    Returns:
+        the events to give to the lambda handler
+    """
+    generator: random.Random = random.Random(seed)
+    events: List[Dict[str, Any]] = []
+    for _ in range(number_of_requests):
+        job_spec: Dict[str, str] = {
+            "type": "ADD",
+            "subscriber": f"subscriber{generator.randrange(number_of_subscribers)}"
+            "@example.com",
+            "slug": generator.choice(catalog)["slug"],
+        }
+        event_shape: str = generator.choice(EVENT_SHAPES) if shape == "mixed" else shape
+        events.append(shape_event(job_spec, event_shape))
+    return events
+
+
+def load_recorded_events(path: str) -> List[Dict[str, Any]]:
+    """Loads events from a file with one JSON event per line."""
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def add_recorded_games(
+    catalog: List[Dict[str, Any]], events: List[Dict[str, Any]]
+) -> None:
+    """Adds a synthetic game to the catalog for each slug named in the events."""
+    known_slugs: Set[str] = {game["slug"] for game in catalog}
+    for event in events:
+        slug: Optional[str] = subscribe_lambda_function.detect_call_type(
+            deepcopy(event)
+        ).get("slug")
+        if (slug is not None) and (slug not in known_slugs):
+            known_slugs.add(slug)
+            catalog.append(
+                {
+                    "slug": slug,
+                    "title": " ".join(slug.split("-")[:-1]),
+                    "lowestPrice": 19.99,
+                    "boxart": "",
+                    "description": f"Stand-in for recorded game {slug}",
+                }
+            )
+
+
+def subscriptions() -> Set[Tuple[str, str]]:
+    """Gets the (game key, subscriber) pairs currently saved in (local) s3."""
+    return {
+        (game_key, address)
+        for (game_key, state) in load_game_subscriber_states_from_s3().items()
+        for address in state.to_addresses
+    }
+
+
+def invoke(
+    event: Dict[str, Any], batcher: Optional[SubscribeBatcher] = None
+) -> Tuple[float, Optional[str]]:
+    """
+    Calls the subscribe lambda handler (or performs the event's job in a batch if a
+    batcher is given), returning latency and any error message.
+    """
+    start: float = time.perf_counter()
+    try:
+        if batcher is None:
+            subscribe_lambda_function.lambda_handler(deepcopy(event), None)
+        else:
+            batcher.perform(
+                subscribe_lambda_function.detect_call_type(deepcopy(event))
+            )
+    except Exception as error:
+        return (time.perf_counter() - start, f"{type(error).__name__}: {error}")
+    return (time.perf_counter() - start, None)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Gets the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return float("nan")
+    index: int = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_load_test(
+    events: List[Dict[str, Any]],
+    catalog: List[Dict[str, Any]],
+    concurrency: int,
+    s3_latency: float,
+    algolia_latency: float,
+    batch_window: Optional[float] = None,
+) -> Dict[str, Any]:
+    """
+    Replays the events at the given concurrency and measures the results.
+
+    Lost updates are found by also replaying the events serially (without latency)
+    and counting subscriptions that differ between the serial and concurrent runs.
+
+    Returns:
+        report with latency percentiles (ms), throughput, errors, and lost updates
+    """
+    local_backends.install_local_backends(catalog)
+    for event in events:
+        invoke(event)
+    expected: Set[Tuple[str, str]] = subscriptions()
+
+    s3 = local_backends.install_local_backends(
+        catalog, s3_latency=s3_latency, algolia_latency=algolia_latency
+    )
+    batcher: Optional[SubscribeBatcher] = None
+    if batch_window is not None:
+        batcher = SubscribeBatcher(batch_window, max_batch_size=len(events))
+        batcher.start()
+    start: float = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results: List[Tuple[float, Optional[str]]] = list(
+            executor.map(partial(invoke, batcher=batcher), events)
+        )
+    elapsed: float = time.perf_counter() - start
+    if batcher is not None:
+        batcher.stop()
+    actual: Set[Tuple[str, str]] = subscriptions()
+
+    latencies: List[float] = sorted(latency for (latency, _) in results)
+    errors: List[str] = [error for (_, error) in results if error is not None]
+    return {
+        "requests": len(events),
+        "concurrency": concurrency,
+        "batch_window_ms": None if batch_window is None else 1000 * batch_window,
+        "p50_ms": 1000 * percentile(latencies, 0.50),
+        "p95_ms": 1000 * percentile(latencies, 0.95),
+        "p99_ms": 1000 * percentile(latencies, 0.99),
+        "throughput_per_s": len(events) / elapsed if elapsed else float("inf"),
+        "errors": len(errors),
+        "error_examples": sorted(set(errors))[:5],
+        "lost_updates": len(expected - actual),
+        "unexpected_updates": len(actual - expected),
+        "s3_calls": s3.calls,
+    }
+
+
+def parse_args() -> Namespace:
+    """Parses the command line arguments."""
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--events", help="file with one recorded JSON event per line (optional)"
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--shape", choices=(*EVENT_SHAPES, "mixed"), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--s3-latency-ms", type=float, default=20.0)
+    parser.add_argument("--algolia-latency-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--batch-window-ms",
+        type=float,
+        help="perform events in batches collected over this many milliseconds",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print report as JSON")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Runs a load test as configured on the command line and prints its report."""
+    args: Namespace = parse_args()
+    catalog: List[Dict[str, Any]] = local_backends.make_catalog(args.games, args.seed)
+    if args.events:
+        events: List[Dict[str, Any]] = load_recorded_events(args.events)
+        add_recorded_games(catalog, events)
+    else:
+        events = make_synthetic_events(
+            catalog, args.requests, args.subscribers, args.shape, seed=args.seed
+        )
+    report: Dict[str, Any] = run_load_test(
+        events,
+        catalog,
+        concurrency=args.concurrency,
+        s3_latency=args.s3_latency_ms / 1000,
+        algolia_latency=args.algolia_latency_ms / 1000,
+        batch_window=(
+            None if args.batch_window_ms is None else args.batch_window_ms / 1000
+        ),
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    for (name, value) in report.items():
+        formatted: str = f"{value:.1f}" if isinstance(value, float) else str(value)
+        print(f"{name:>20}: {formatted}")
+
+
+if __name__ == "__main__":
+    main()
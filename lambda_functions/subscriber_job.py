@@ -1,17 +1,18 @@
 """Module defining all of the possible jobs to modify subscriptions."""
 from abc import ABCMeta, abstractmethod
-from math import nan
+from math import isfinite, nan
 import os
-from typing import Any, Callable, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 from botocore.response import StreamingBody
 import boto3
 
+from email_outbox import enqueue_email
 from game_shop_state import GameShopState
 from get_logger import get_logger
 from link_formatter import make_link_formatter
-from send_email import send_email
-from subscriber_state import SingleGameSubscriberState
+from shop_region import DEFAULT_REGION, get_region
+from subscriber_state import make_game_key, SingleGameSubscriberState, split_game_key
 
 logger = get_logger(__file__)
 s3_client = boto3.client("s3")
@@ -20,12 +21,18 @@ STORECHECKER_S3_BUCKET: str = os.environ["STORECHECKER_S3_BUCKET"]
 SUBSCRIBE_URL_S3_KEY: str = os.environ["SUBSCRIBE_URL_S3_KEY"]
 
 
+_this_functions_url: Optional[str] = None
+
+
 def get_this_functions_url() -> str:
-    """Gets the URL of this function."""
-    data: StreamingBody = s3_client.get_object(
-        Bucket=STORECHECKER_S3_BUCKET, Key=SUBSCRIBE_URL_S3_KEY
-    )["Body"]
-    return data.read().decode()
+    """Gets the URL of this function (only fetched once per container)."""
+    global _this_functions_url
+    if _this_functions_url is None:
+        data: StreamingBody = s3_client.get_object(
+            Bucket=STORECHECKER_S3_BUCKET, Key=SUBSCRIBE_URL_S3_KEY
+        )["Body"]
+        _this_functions_url = data.read().decode()
+    return _this_functions_url
 
 
 class SubscriberJob(metaclass=ABCMeta):
@@ -44,16 +51,19 @@ class SubscriberJob(metaclass=ABCMeta):
 class AddGameJob(SubscriberJob):
     """Class that adds a game with a name and the query used to find it."""
 
-    def __init__(self, slug: str, title: str):
+    def __init__(self, slug: str, title: str, region: str = DEFAULT_REGION):
         """
         Creates a new AddGameJob
 
         Args:
             slug: the unique slug of the game
             title: the full title of the game
+            region: the name of the regional eShop to track the game in
         """
         self.slug: str = slug
         self.title = title
+        self.region: str = region
+        self.game_key: str = make_game_key(slug, region)
 
     def perform(self, state: Dict[str, SingleGameSubscriberState]) -> Dict[str, Any]:
         """
@@ -62,18 +72,19 @@ class AddGameJob(SubscriberJob):
         NOTE: throws an error if the game handle already exists.
         """
         response: Dict[str, Any] = {"type": str(type(self))}
-        if (current_state := state.get(self.slug)) is None:
+        if (current_state := state.get(self.game_key)) is None:
             new_state: SingleGameSubscriberState = SingleGameSubscriberState(
-                to_addresses=[], title=self.title
+                to_addresses=[], title=self.title, region=self.region
             )
-            state[self.slug] = new_state
+            state[self.game_key] = new_state
             logger.info(
                 f'Adding new game "{self.title}" with state {new_state.dictionary}'
             )
             response.update({"success": True, "reason": ""})
         else:
             logger.warning(
-                f'Trying to add game with slug "{self.slug}" to subscribed games, '
+                f'Trying to add game with slug "{self.slug}" in region {self.region} '
+                "to subscribed games, "
                 f"but it already exists with value {current_state.dictionary}"
             )
             response.update({"success": False, "reason": "game already exists"})
@@ -90,12 +101,17 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
         lowest_price: float,
         subscribers_to_add: Optional[List[str]] = None,
         subscribers_to_remove: Optional[List[str]] = None,
+        target_price: Optional[float] = None,
+        region: str = DEFAULT_REGION,
     ):
         """
         Args:
             name: the handle of the game to modify the subcribers of
             subscribers_to_add: if applicable, the subscribers to newly include
             subscribers_to_remove: if applicable, the subscribers to remove
+            target_price: if given, subscribers_to_add are only updated when the
+                price crosses this target (instead of on every price change)
+            region: the name of the regional eShop the game is tracked in
         """
         self.subscribers_to_add: List[str] = [
             subscriber.lower() for subscriber in (subscribers_to_add or [])
@@ -105,6 +121,9 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
         ]
         self.slug: str = slug
         self.lowest_price: float = lowest_price
+        self.target_price: Optional[float] = target_price
+        self.region: str = region
+        self.game_key: str = make_game_key(slug, region)
         self._link_formatter: Optional[Callable[[str, str], str]] = None
 
     @property
@@ -115,16 +134,17 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
         """
         if self._link_formatter is None:
             self._link_formatter = make_link_formatter(
-                get_this_functions_url(), self.slug
+                get_this_functions_url(), self.slug, region=self.region
             )
         return self._link_formatter
     
     def perform(self, state: Dict[str, SingleGameSubscriberState]) -> Dict[str, Any]:
         """Mutates game's subscriber state by adding and/or removing subscribers"""
         response: Dict[str, Any] = {"type": str(type(self))}
-        if (game_state := state.get(self.slug)) is None:
+        if (game_state := state.get(self.game_key)) is None:
             raise ValueError(
-                f'Cannot update subscribers of game "{self.slug}" because '
+                f'Cannot update subscribers of game "{self.slug}" in region '
+                f"{self.region} because "
                 f"that game does not exist (existing games: {list(state)})."
             )
         subscribers_added: List[str] = []
@@ -135,11 +155,27 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
                     f'Trying to add {new_subscriber} to game "{game_state.title}", '
                     "but they are already a subscriber! Not sending any email."
                 )
+                if self.target_price is not None:
+                    logger.info(
+                        f"Setting target price of {new_subscriber} for game "
+                        f'"{game_state.title}" to '
+                        f"{get_region(self.region).format_price(self.target_price)}."
+                    )
+                    game_state.price_targets.add(new_subscriber, self.target_price)
+                elif new_subscriber in game_state.price_targets:
+                    # subscribing again without a target means every change again
+                    logger.info(
+                        f"Clearing target price of {new_subscriber} for game "
+                        f'"{game_state.title}".'
+                    )
+                    game_state.price_targets.remove(new_subscriber)
             else:
                 try:
                     remove_index: int = self.subscribers_to_remove.index(new_subscriber)
                 except ValueError:
                     game_state.to_addresses.append(new_subscriber)
+                    if self.target_price is not None:
+                        game_state.price_targets.add(new_subscriber, self.target_price)
                     subscribers_added.append(new_subscriber)
                 else:
                     logger.error(
@@ -148,7 +184,15 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
                         f"sending any email."
                     )
                     self.subscribers_to_remove.pop(remove_index)
-        send_email(
+        target_paragraph: str = ""
+        if self.target_price is not None:
+            target_paragraph = (
+                "<p>"
+                "You will only be updated when the price crosses your target price "
+                f"of {get_region(self.region).format_price(self.target_price)}."
+                "</p>"
+            )
+        enqueue_email(
             to_addresses=subscribers_added,
             subject=f"Thanks for subscribing to price updates for {game_state.title}!",
             body=(
@@ -156,8 +200,9 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
                     "<p>"
                     f"You have been added as a subscriber to {game_state.title} price "
                     f"updates.\n\nThe current price of {game_state.title} is "
-                    f"${self.lowest_price:.2f}."
+                    f"{get_region(self.region).format_price(self.lowest_price)}."
                     "</p>"
+                    f"{target_paragraph}"
                     "<p>"
                     "To unsubscribe from price updates on this game, click "
                     '<a href="{single_game_unsubscribe_link}">here</a>.'
@@ -184,7 +229,8 @@ class AddOrSubtractSubscribersJob(SubscriberJob):
             else:
                 # this is the happy path
                 game_state.to_addresses.pop(index)
-        send_email(
+                game_state.price_targets.remove(removed_subscriber)
+        enqueue_email(
             to_addresses=self.subscribers_to_remove,
             subject=f"You have been unsubscribed from {game_state.title} price updates",
             body=(
@@ -227,7 +273,8 @@ class RemoveSubscriberJob(SubscriberJob):
                 pass
             else:
                 value.to_addresses.pop(index)
-        send_email(
+                value.price_targets.remove(self.to_address)
+        enqueue_email(
             to_addresses = [self.to_address],
             subject="Unsubscribed from all price updates",
             body="You have been unsubscribed from all price updates.",
@@ -250,8 +297,12 @@ class CheckSubscriberJob(SubscriberJob):
         return {
             "type": str(type(self)),
             "games": [
-                {"title": subscriber_state.title, "slug": slug}
-                for (slug, subscriber_state) in state.items()
+                {
+                    "title": subscriber_state.title,
+                    "slug": split_game_key(game_key)[0],
+                    "region": subscriber_state.region,
+                }
+                for (game_key, subscriber_state) in state.items()
                 if self.to_address in subscriber_state.to_addresses
             ],
         }
@@ -263,11 +314,17 @@ class RemoveEmptyGamesSubscriberJob(SubscriberJob):
     def perform(self, state: Dict[str, SingleGameSubscriberState]) -> Dict[str, Any]:
         """Removing stored data about games with no subscribers."""
         games_to_remove: List[Dict[str, str]] = []
-        for (slug, value) in state.items():
+        for (game_key, value) in state.items():
             if not value.to_addresses:
-                games_to_remove.append({"title": value.title, "slug": slug})
+                games_to_remove.append(
+                    {
+                        "title": value.title,
+                        "slug": split_game_key(game_key)[0],
+                        "region": value.region,
+                    }
+                )
         for game in games_to_remove:
-            state.pop(game["slug"])
+            state.pop(make_game_key(game["slug"], game["region"]))
         return {"type": str(type(self)), "games_removed": games_to_remove}
 
 
@@ -288,18 +345,25 @@ class _SubscriberJobParser:
     """Class that will parse a SubscriberJob from an input the subscribe lambda"""
 
     def __init__(
-        self, event: Dict[str, Any], state: Dict[str, SingleGameSubscriberState]
+        self,
+        event: Dict[str, Any],
+        state: Dict[str, SingleGameSubscriberState],
+        shop_state: Optional[GameShopState] = None,
     ):
         """
         Creates an object that will parse a SubscriberJob from given event.
 
         Args:
             event: the incoming event to the subscribe lambda function
+            state: the current state of subscriptions
+            shop_state: the already looked up shop state of the event's game, if any
+                (see prefetch_shop_state)
         """
         self.details: Dict[str, Any] = event
         self.event_type: str = self.details.pop("type")
         self.subscriber: str = self.details.pop("subscriber")
         self.state: Dict[str, SingleGameSubscriberState] = state
+        self.shop_state: Optional[GameShopState] = shop_state
         self._jobs: List[SubscriberJob] = []
         self.parsed: SubscriberJob = self._parse()
 
@@ -310,16 +374,46 @@ class _SubscriberJobParser:
         NOTE: Requires parameters in event:
             name: the string handle to refer to the game with
             subscriber: email address to subscribe to updates on given game
+            region (optional): the name of the regional eShop to track the game in.
+                Defaults to the US eShop.
+            target_price (optional): if given, the subscriber is only updated when the
+                price crosses this target (e.g. "19.99" to hear when it drops to $19.99)
+                and subscribing again without a target clears any existing target
         """
         slug: str = self.details["slug"]
-        shop_state: GameShopState = GameShopState(slug)
-        if slug not in self.state:
-            self._jobs.append(AddGameJob(slug=slug, title=shop_state.title))
+        region: str = self.details.get("region", DEFAULT_REGION)
+        target_price: Optional[float] = None
+        if (target_price_string := self.details.get("target_price")) is not None:
+            try:
+                target_price = float(target_price_string)
+            except ValueError:
+                raise ValueError(
+                    f'Could not parse target price "{target_price_string}" as a number.'
+                )
+            if not (isfinite(target_price) and (target_price > 0)):
+                raise ValueError(
+                    f'Target price "{target_price_string}" must be a finite number '
+                    "above zero."
+                )
+        if (
+            (self.shop_state is not None)
+            and (self.shop_state.slug == slug)
+            and (self.shop_state.region.name == region)
+        ):
+            shop_state: GameShopState = self.shop_state
+        else:
+            shop_state = GameShopState(slug, region)
+        if make_game_key(slug, region) not in self.state:
+            self._jobs.append(
+                AddGameJob(slug=slug, title=shop_state.title, region=region)
+            )
         self._jobs.append(
             AddOrSubtractSubscribersJob(
                 slug=slug,
                 subscribers_to_add=[self.subscriber],
                 lowest_price=shop_state.lowest_price,
+                target_price=target_price,
+                region=region,
             )
         )
         return
@@ -332,6 +426,8 @@ class _SubscriberJobParser:
             slug (optional): if given, the unique string handle with which to refer to
                 the single game from which to unsubscribe. if not given, unsubscribes
                 from all games.
+            region (optional): the name of the regional eShop the single game is
+                tracked in. Defaults to the US eShop.
             subscriber: email address to unsubscribe to updates on one or all games
         """
         if (slug := self.details.get("slug")) is None:
@@ -339,7 +435,10 @@ class _SubscriberJobParser:
         else:
             self._jobs.append(
                 AddOrSubtractSubscribersJob(
-                    slug=slug, subscribers_to_remove=[self.subscriber], lowest_price=nan
+                    slug=slug,
+                    subscribers_to_remove=[self.subscriber],
+                    lowest_price=nan,
+                    region=self.details.get("region", DEFAULT_REGION),
                 )
             )
         self._jobs.append(RemoveEmptyGamesSubscriberJob())
@@ -376,8 +475,29 @@ class _SubscriberJobParser:
             raise ValueError("For some reason, no jobs were able to be parsed.")
 
 
+def prefetch_shop_state(event: Dict[str, Any]) -> Optional[GameShopState]:
+    """
+    Looks up the shop state of the game of an ADD event, so that the lookup can be
+    done before (and passed to) parse_and_perform_subscriber_job, e.g. outside of a
+    lock on the state.
+
+    Returns:
+        the game's shop state with its title and price fetched, or None if the
+        event doesn't need one
+    """
+    if event.get("type") != "ADD":
+        return None
+    shop_state: GameShopState = GameShopState(
+        event["slug"], event.get("region", DEFAULT_REGION)
+    )
+    shop_state.lowest_price  # fetches the title and price
+    return shop_state
+
+
 def parse_and_perform_subscriber_job(
-    event: Dict[str, Any], state: Dict[str, SingleGameSubscriberState]
+    event: Dict[str, Any],
+    state: Dict[str, SingleGameSubscriberState],
+    shop_state: Optional[GameShopState] = None,
 ) -> Dict[str, Any]:
     """
     Parses a job to change the subscribe state from the event input to the lambda
@@ -387,8 +507,48 @@ def parse_and_perform_subscriber_job(
             of event["type"]. All other elements of event are specific to the type. See
             _parse_* methods of _SubscriberJobParser for formats.
         state: the current state of subscriptions. This will be modified!
+        shop_state: the shop state of the event's game if already looked up (see
+            prefetch_shop_state). Otherwise, it's looked up if needed.
 
     Returns:
         the response to send to the caller of the lambda function
     """
-    return _SubscriberJobParser(event, state).parsed.perform(state)
+    return _SubscriberJobParser(event, state, shop_state).parsed.perform(state)
+
+
+def parse_and_perform_subscriber_jobs(
+    events: Sequence[Dict[str, Any]],
+    state: Dict[str, SingleGameSubscriberState],
+    shop_states: Optional[Sequence[Optional[GameShopState]]] = None,
+) -> List[Tuple[bool, Any]]:
+    """
+    Parses and performs the jobs of many events on one copy of the subscribe state,
+    so that a batch of events needs a single load and save of the state.
+
+    Each event is parsed only after the jobs of the events before it are performed,
+    since parsing depends on the state (e.g. whether a game must be added first).
+    An event whose job can't be parsed or performed doesn't affect the others.
+
+    Args:
+        events: the input events to the lambda function (see
+            parse_and_perform_subscriber_job). These will be modified!
+        state: the current state of subscriptions. This will be modified!
+        shop_states: if given, the already looked up shop state (or None) of each
+            event's game, in the same order as events (see prefetch_shop_state)
+
+    Returns:
+        a (success, result) pair for each event in the same order as events. If the
+        job succeeded, result is its response. Otherwise, result is the error.
+    """
+    if shop_states is None:
+        shop_states = [None] * len(events)
+    results: List[Tuple[bool, Any]] = []
+    for (event, shop_state) in zip(events, shop_states):
+        try:
+            results.append(
+                (True, parse_and_perform_subscriber_job(event, state, shop_state))
+            )
+        except Exception as error:
+            logger.warning(f"Subscriber job of batched event failed: {error}")
+            results.append((False, error))
+    return results
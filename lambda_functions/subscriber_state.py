@@ -2,14 +2,17 @@
 Module with class that can represent subscriber state,
 along with functions to load it from and save it to s3.
 """
+from bisect import bisect_left, insort
 from datetime import datetime
 import json
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
+from botocore.exceptions import ClientError
 import boto3
 
 from get_logger import get_logger
+from shop_region import DEFAULT_REGION
 
 STORECHECKER_S3_BUCKET: str = os.environ["STORECHECKER_S3_BUCKET"]
 SUBSCRIBERS_S3_KEY: str = os.environ["SUBSCRIBERS_S3_KEY"]
@@ -17,6 +20,90 @@ SUBSCRIBERS_S3_KEY: str = os.environ["SUBSCRIBERS_S3_KEY"]
 logger = get_logger(__file__)
 s3_client = boto3.client("s3")
 
+# separates the region from the slug in the keys of games outside the default region
+GAME_KEY_SEPARATOR: str = ":"
+
+# (ETag, JSON form) of the subscriber state this container last loaded or saved
+_cached_json_data: Optional[Tuple[str, Dict[str, Dict[str, Any]]]] = None
+
+
+def make_game_key(slug: str, region: str = DEFAULT_REGION) -> str:
+    """
+    Makes the key of a game tracked in a region, used by the subscriber and update
+    states so that one game can be tracked in many regions.
+
+    Games in the default region are keyed by slug alone (as they were before games
+    could be tracked in more than one region), others by e.g. "EU:slug".
+    """
+    if region == DEFAULT_REGION:
+        return slug
+    return f"{region}{GAME_KEY_SEPARATOR}{slug}"
+
+
+def split_game_key(game_key: str) -> Tuple[str, str]:
+    """Splits a key made by make_game_key into (slug, region)."""
+    (region, _, slug) = game_key.rpartition(GAME_KEY_SEPARATOR)
+    return (slug, region or DEFAULT_REGION)
+
+
+class PriceTargetIndex:
+    """
+    Class that keeps subscribers' target prices for a single game sorted by price,
+    so that the subscribers whose target was crossed can be found with a bisect.
+    """
+
+    def __init__(self, entries: Optional[Sequence[Sequence[Any]]] = None):
+        """
+        Creates a new index of target prices
+
+        Args:
+            entries: (target_price, address) pairs to start the index with
+        """
+        self._targets: Dict[str, float] = {}
+        self._sorted: List[Tuple[float, str]] = []
+        for (target_price, address) in entries or []:
+            self.add(address, target_price)
+
+    def __contains__(self, address: str) -> bool:
+        """Whether the given subscriber has a target price"""
+        return address in self._targets
+
+    def __len__(self) -> int:
+        """The number of subscribers with a target price"""
+        return len(self._sorted)
+
+    def add(self, address: str, target_price: float) -> None:
+        """Sets the target price of the subscriber, replacing any existing target."""
+        self.remove(address)
+        self._targets[address] = float(target_price)
+        insort(self._sorted, (float(target_price), address))
+
+    def remove(self, address: str) -> bool:
+        """Removes the subscriber's target price. Returns False if there was none."""
+        if (target_price := self._targets.pop(address, None)) is None:
+            return False
+        self._sorted.pop(bisect_left(self._sorted, (target_price, address)))
+        return True
+
+    def crossed(self, old_price: float, new_price: float) -> List[str]:
+        """
+        Finds the subscribers whose target price was crossed by a price change.
+
+        A price drop from old_price to new_price crosses targets in
+        [new_price, old_price), i.e. the price reached or went below the target.
+        A price rise crosses targets in [old_price, new_price), i.e. the price went
+        back above a target that had previously been reached.
+        """
+        (low, high) = sorted((old_price, new_price))
+        start: int = bisect_left(self._sorted, (low, ""))
+        stop: int = bisect_left(self._sorted, (high, ""))
+        return [address for (_, address) in self._sorted[start:stop]]
+
+    @property
+    def entries(self) -> List[List[Any]]:
+        """JSON-able list of [target_price, address] pairs sorted by target price"""
+        return [[target_price, address] for (target_price, address) in self._sorted]
+
 
 class SingleGameSubscriberState:
     """Class that can represent subscriber state for a given game"""
@@ -26,6 +113,8 @@ class SingleGameSubscriberState:
         to_addresses: List[str],
         title: str,
         last_updated: Optional[str] = None,
+        price_targets: Optional[List[List[Any]]] = None,
+        region: str = DEFAULT_REGION,
     ):
         """
         Initializes in-memory state for single game
@@ -35,10 +124,16 @@ class SingleGameSubscriberState:
             title: the full string title of the game
             last_updated: YYYYmmDDHHMMSS timestamp of when this game was last updated
                 NOTE: this is distinct from when subscribers were last updated!
+            price_targets: [target_price, address] pairs of subscribers that only want
+                to hear about price changes that cross their target price. Subscribers
+                without a target are updated on any price change.
+            region: the name of the regional eShop the game is tracked in
         """
         self.to_addresses: List[str] = to_addresses
         self.title: str = title
         self.last_updated = last_updated or datetime.now().strftime(r"%Y%m%d%H%M%S")
+        self.price_targets: PriceTargetIndex = PriceTargetIndex(price_targets)
+        self.region: str = region
 
     @property
     def dictionary(self) -> Dict[str, Any]:
@@ -47,30 +142,68 @@ class SingleGameSubscriberState:
             "to_addresses": self.to_addresses,
             "title": self.title,
             "last_updated": self.last_updated,
+            "price_targets": self.price_targets.entries,
+            "region": self.region,
         }
 
 
+def _copy_json_data(data: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Copies JSON form of subscriber state deeply enough that it can be mutated."""
+    return {
+        name: {**value, "to_addresses": list(value["to_addresses"])}
+        for (name, value) in data.items()
+    }
+
+
 def load_game_subscriber_states_from_s3() -> Dict[str, SingleGameSubscriberState]:
-    """Loads subscriber state of all games from s3"""
-    data: Dict[str, Dict[str, Any]] = json.load(
-        s3_client.get_object(
-            Bucket=STORECHECKER_S3_BUCKET, Key=SUBSCRIBERS_S3_KEY
-        )["Body"]
-    )
-    logger.info(f"Loaded {len(data)} games of subscriber state from s3.")
-    return {key: SingleGameSubscriberState(**value) for (key, value) in data.items()}
+    """
+    Loads subscriber state of all games from s3
+
+    The parsed state is cached (per container) along with the ETag of the object, so
+    s3 only sends and this only parses the object again if it changed since then.
+    """
+    global _cached_json_data
+    kwargs: Dict[str, str] = {
+        "Bucket": STORECHECKER_S3_BUCKET,
+        "Key": SUBSCRIBERS_S3_KEY,
+    }
+    if _cached_json_data is not None:
+        kwargs["IfNoneMatch"] = _cached_json_data[0]
+    try:
+        response: Dict[str, Any] = s3_client.get_object(**kwargs)
+    except ClientError as error:
+        if (_cached_json_data is None) or (
+            error.response.get("Error", {}).get("Code") not in ("304", "NotModified")
+        ):
+            raise
+        data: Dict[str, Dict[str, Any]] = _cached_json_data[1]
+        logger.info(f"Reusing {len(data)} cached games of unchanged subscriber state.")
+    else:
+        data = json.load(response["Body"])
+        _cached_json_data = (response["ETag"], data)
+        logger.info(f"Loaded {len(data)} games of subscriber state from s3.")
+    # states saved before games were keyed by region are keyed by slug alone
+    return {
+        make_game_key(split_game_key(key)[0], value.get("region", DEFAULT_REGION)): (
+            SingleGameSubscriberState(**value)
+        )
+        for (key, value) in _copy_json_data(data).items()
+    }
 
 
 def save_game_subscriber_states_to_s3(
     data: Dict[str, SingleGameSubscriberState]
 ) -> Dict[str, Dict[str, Any]]:
     """Saves subscriber state of all games to s3 and returns JSON form of saved data"""
+    global _cached_json_data
     json_data: Dict[str, Dict[str, Any]] = {
         name: value.dictionary for (name, value) in data.items()
     }
     body: bytes = json.dumps(json_data).encode()
-    s3_client.put_object(
+    response: Dict[str, Any] = s3_client.put_object(
         Bucket=STORECHECKER_S3_BUCKET, Key=SUBSCRIBERS_S3_KEY, Body=body
     )
+    # the ETag of this container's own write revalidates the cache for the next load
+    _cached_json_data = (response["ETag"], _copy_json_data(json_data))
     logger.info(f"Saved {len(data)} single game subscriber states to s3.")
     return json_data
@@ -1,12 +1,16 @@
 """Module with class that updates subscribers about price changes."""
 import os
-from typing import Optional
+from typing import List, Optional, Set
 
 from game_shop_state import GameShopState
 from get_logger import get_logger
 from link_formatter import make_link_formatter
 from send_email import send_email
-from subscriber_state import SingleGameSubscriberState
+from send_ledger import make_send_key, SendLedger
+from shop_region import ShopRegion
+from subscriber_state import (
+    make_game_key, PriceTargetIndex, SingleGameSubscriberState
+)
 from update_state import SingleGameUpdateState
 
 SUBSCRIBE_LAMBDA_URL: str = os.environ["SUBSCRIBE_LAMBDA_URL"]
@@ -27,19 +31,35 @@ class UpdateJob:
         """
         self.slug: str = slug
         self.subscriber_state: SingleGameSubscriberState = subscriber_state
+        self.game_key: str = make_game_key(slug, subscriber_state.region)
         self._shop_state: Optional[GameShopState] = None
 
     @property
     def shop_state(self) -> GameShopState:
-        """The current lowest price of the game in USD."""
+        """The current lowest price of the game in the currency of its region."""
         if self._shop_state is None:
-            self._shop_state = GameShopState(self.slug)
+            self._shop_state = GameShopState(
+                self.slug, region=self.subscriber_state.region
+            )
         return self._shop_state
 
     def perform(
-        self, current_state: Optional[SingleGameUpdateState]
+        self,
+        current_state: Optional[SingleGameUpdateState],
+        ledger: Optional[SendLedger] = None,
     ) -> SingleGameUpdateState:
-        """Updates all subscribers via email if the price has changes."""
+        """
+        Updates all subscribers via email if the price has changes.
+
+        Returns current_state itself (so that it isn't rewritten) if neither the
+        price nor the subscribers changed.
+
+        Args:
+            current_state: the update state of the game from the last check (if any)
+            ledger: if given, subscribers that the ledger says were already sent this
+                price change (by a run that didn't finish) are skipped, and each
+                email sent is recorded in it
+        """
         new_state: SingleGameUpdateState = SingleGameUpdateState(
             lowest_price=self.shop_state.lowest_price,
             subscribers_up_to_date=self.subscriber_state.to_addresses
@@ -49,35 +69,79 @@ class UpdateJob:
                 f"First fulfillment for game {self.shop_state.title}. No email to send."
             )
             return new_state
+        region: ShopRegion = self.shop_state.region
         price_change: float = new_state.lowest_price - current_state.lowest_price
         if abs(price_change) <= 0.01:
             logger.info(
-                f"Price ({self.shop_state.title}) hasn't changed above $0.01 level: "
-                f"${current_state.lowest_price:.2f} -> ${new_state.lowest_price:.2f}"
+                f"Price ({self.shop_state.title}) hasn't changed above "
+                f"{region.format_price(0.01)} level: "
+                f"{region.format_price(current_state.lowest_price)} -> "
+                f"{region.format_price(new_state.lowest_price)}"
             )
+            if (price_change == 0) and (
+                current_state.subscribers_up_to_date
+                == new_state.subscribers_up_to_date
+            ):
+                return current_state
             return new_state
-        continuing_subscribers = [
+        # subscribers with a target price are only updated when it is crossed, which
+        # is found with a bisect of the sorted targets instead of a scan
+        price_targets: PriceTargetIndex = self.subscriber_state.price_targets
+        previous_subscribers: Set[str] = set(current_state.subscribers_up_to_date)
+        continuing_subscribers: List[str] = [
             subscriber
-            for subscriber in current_state.subscribers_up_to_date
-            if subscriber in new_state.subscribers_up_to_date
+            for subscriber in price_targets.crossed(
+                current_state.lowest_price, new_state.lowest_price
+            )
+            if subscriber in previous_subscribers
         ]
+        if len(price_targets) < len(new_state.subscribers_up_to_date):
+            continuing_subscribers.extend(
+                subscriber
+                for subscriber in new_state.subscribers_up_to_date
+                if (subscriber in previous_subscribers)
+                and (subscriber not in price_targets)
+            )
         if not continuing_subscribers:
             logger.info(
                 "No continuing subscribers to update. (New subscribers "
-                "should've received first email from subscribe lambda)"
+                "should've received first email from subscribe lambda and "
+                "subscribers with target prices are only updated when crossed)"
             )
             return new_state
+        transition: str = (
+            f"{current_state.lowest_price:.2f}->{new_state.lowest_price:.2f}"
+        )
+        if ledger is not None:
+            already_sent: Set[str] = {
+                subscriber
+                for subscriber in continuing_subscribers
+                if make_send_key(self.game_key, transition, subscriber) in ledger
+            }
+            if already_sent:
+                logger.info(
+                    f"Skipping {len(already_sent)} subscribers that were already "
+                    f"sent the {transition} price change of {self.game_key}."
+                )
+                continuing_subscribers = [
+                    subscriber
+                    for subscriber in continuing_subscribers
+                    if subscriber not in already_sent
+                ]
+            if not continuing_subscribers:
+                return new_state
         adjective: str = "up" if (price_change > 0) else "down"
         subject: str = (
             f'Price {"increase" if (price_change > 0) else "decrease"} '
-            f"on {self.subscriber_state.title} by ${abs(price_change):.2f}"
+            f"on {self.subscriber_state.title} by "
+            f"{region.format_price(abs(price_change))}"
         )
         message: str = (
             "<div>"
             "<p>"
             f"The current price of {self.subscriber_state.title} is "
-            f"${self.shop_state.lowest_price:.2f}, {adjective} "
-            f"from old price of ${current_state.lowest_price:.2f}.\n\n"
+            f"{region.format_price(self.shop_state.lowest_price)}, {adjective} "
+            f"from old price of {region.format_price(current_state.lowest_price)}.\n\n"
             "</p>"
             "<p>"
             "To unsubscribe from price updates on this game, click "
@@ -94,6 +158,15 @@ class UpdateJob:
             subject=subject,
             body=message,
             is_html=True,
-            formatter=make_link_formatter(SUBSCRIBE_LAMBDA_URL, slug=self.slug),
+            formatter=make_link_formatter(
+                SUBSCRIBE_LAMBDA_URL, slug=self.slug, region=region.name
+            ),
+            on_sent=(
+                None
+                if ledger is None
+                else lambda subscriber: ledger.record(
+                    make_send_key(self.game_key, transition, subscriber)
+                )
+            ),
         )
         return new_state
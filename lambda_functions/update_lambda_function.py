@@ -2,12 +2,18 @@
 Main handler module for the fulfillment lambda function, which runs periodically
 to check all current game prices and notify subscribers of any changes.
 """
-from typing import Any, Dict
+from datetime import datetime
+import os
+from typing import Any, Dict, List, Optional, Tuple
 
 from update_job import UpdateJob
 from get_logger import get_logger
+from poll_scheduler import PollScheduler
+from profiling import profiled
+from send_ledger import SendLedger
+from shop_region import fetch_in_parallel
 from subscriber_state import (
-    load_game_subscriber_states_from_s3, SingleGameSubscriberState
+    load_game_subscriber_states_from_s3, SingleGameSubscriberState, split_game_key
 )
 from update_state import (
     load_game_update_states_from_s3,
@@ -15,24 +21,93 @@ from update_state import (
     SingleGameUpdateState,
 )
 
+SEND_LEDGER_S3_KEY: str = os.environ["SEND_LEDGER_S3_KEY"]
+
 logger = get_logger(__file__)
+scheduler: PollScheduler = PollScheduler()
 
 
-def lambda_handler(event: Any, _: Any) -> Dict[str, Dict[str, Any]]:
+def run_fulfillment(
+    subscriber_state: Dict[str, SingleGameSubscriberState]
+) -> Dict[str, Any]:
     """
-    Checks all current game prices and notifies subscribers of any changes
+    Checks the prices of all games that are due (see poll_scheduler module) or
+    whose subscribers changed since their last check and notifies subscribers of
+    any changes
 
-    NOTE: event is unused
+    Emails sent are recorded in the send ledger until the new update state is
+    saved, so if the run fails partway, its retry only sends the remaining emails.
+
+    Args:
+        subscriber_state: the current subscriber state of all games
+
+    Returns:
+        what was saved to s3 (see update_state.save_game_update_states_to_s3)
     """
-    logger.info(f"Got event: {event}")
     update_state: Dict[str, SingleGameUpdateState] = load_game_update_states_from_s3()
-    subscriber_state: Dict[str, SingleGameSubscriberState] = (
-        load_game_subscriber_states_from_s3()
-    )
+    ledger: SendLedger = SendLedger.load(SEND_LEDGER_S3_KEY)
+    now: datetime = datetime.now()
     new_update_state: Dict[str, SingleGameUpdateState] = {}
-    for (slug, single_subscriber_state) in subscriber_state.items():
-        job: UpdateJob = UpdateJob(slug, single_subscriber_state)
-        new_update_state[slug] = job.perform(update_state.get(slug))
-    resp: Dict[str, Dict[str, Any]] = save_game_update_states_to_s3(new_update_state)
+    jobs: Dict[str, UpdateJob] = {}
+    # both states are keyed by game key (see subscriber_state.make_game_key)
+    for (game_key, single_subscriber_state) in subscriber_state.items():
+        previous: Optional[SingleGameUpdateState] = update_state.get(game_key)
+        # games whose subscribers changed are checked early too, since subscribers
+        # are only updated about changes from a price they were up to date with
+        if scheduler.is_due(previous, now) or (
+            set(single_subscriber_state.to_addresses)
+            != set(previous.subscribers_up_to_date)
+        ):
+            jobs[game_key] = UpdateJob(
+                split_game_key(game_key)[0], single_subscriber_state
+            )
+        else:
+            new_update_state[game_key] = update_state[game_key]
+    logger.info(
+        f"{len(jobs)} of {len(subscriber_state)} games are due for a price check."
+    )
+    # prices are fetched with one worker per region so regions don't add latency
+    fetch_results: List[Tuple[bool, Any]] = fetch_in_parallel(
+        [
+            (job.subscriber_state.region, lambda job=job: job.shop_state.lowest_price)
+            for job in jobs.values()
+        ]
+    )
+    try:
+        for ((game_key, job), (fetched, _)) in zip(jobs.items(), fetch_results):
+            if fetched:
+                new_update_state[game_key] = scheduler.schedule(
+                    update_state.get(game_key),
+                    job.perform(update_state.get(game_key), ledger=ledger),
+                    now,
+                )
+            elif game_key in update_state:
+                logger.warning(
+                    f"Couldn't fetch price of {game_key}. Keeping previous state."
+                )
+                new_update_state[game_key] = update_state[game_key]
+            else:
+                logger.warning(
+                    f"Couldn't fetch price of {game_key}. It has no state yet."
+                )
+    finally:
+        ledger.flush()
+    response: Dict[str, Any] = save_game_update_states_to_s3(
+        new_update_state, update_state
+    )
+    # the saved state now has the new prices, so the sends needn't be remembered
+    ledger.clear()
+    return response
+
+
+@profiled
+def lambda_handler(event: Any, _: Any) -> Dict[str, Any]:
+    """
+    Checks all due game prices and notifies subscribers of any changes
+
+    NOTE: event is unused
+    """
+    logger.info(f"Got event: {event}")
+    resp: Dict[str, Any] = run_fulfillment(load_game_subscriber_states_from_s3())
     logger.info(f"Sending response: {resp}")
     return resp
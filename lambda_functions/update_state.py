@@ -3,6 +3,7 @@ Module with class that can represent who has been updated and
 when, along with functions to load it from and save it to s3.
 """
 from datetime import datetime
+from hashlib import sha256
 import json
 import os
 from typing import Any, Dict, List, Optional
@@ -26,6 +27,9 @@ class SingleGameUpdateState:
         lowest_price: float,
         subscribers_up_to_date: List[str],
         last_updated: Optional[str] = None,
+        next_check: Optional[str] = None,
+        check_interval_hours: Optional[float] = None,
+        volatility: float = 0.0,
     ):
         """
         Initializes the in-memory update state.
@@ -34,10 +38,18 @@ class SingleGameUpdateState:
             lowest_price: the lowest price when this state was made
             subscribers_up_to_date: subscribers that are currently up-to-date on price
             last_updated: timestamp of form YYYYmmDDHHMMSS indicating when last updated
+            next_check: timestamp of form YYYYmmDDHHMMSS of when the price should next
+                be checked (None if it should be checked on the next run)
+            check_interval_hours: the base time between checks, which shrinks when the
+                price changes and grows when it doesn't (see poll_scheduler module)
+            volatility: moving average of the relative size of price changes per check
         """
         self.lowest_price: float = lowest_price
         self.last_updated = last_updated or datetime.now().strftime(r"%Y%m%d%H%M%S")
         self.subscribers_up_to_date: List[str] = subscribers_up_to_date.copy()
+        self.next_check: Optional[str] = next_check
+        self.check_interval_hours: Optional[float] = check_interval_hours
+        self.volatility: float = volatility
 
     @property
     def dictionary(self) -> Dict[str, Any]:
@@ -46,8 +58,16 @@ class SingleGameUpdateState:
             "lowest_price": self.lowest_price,
             "last_updated": self.last_updated,
             "subscribers_up_to_date": self.subscribers_up_to_date,
+            "next_check": self.next_check,
+            "check_interval_hours": self.check_interval_hours,
+            "volatility": self.volatility,
         }
-    
+
+    @property
+    def content_hash(self) -> str:
+        """Hash of the dictionary form, used to detect whether the state changed"""
+        return sha256(json.dumps(self.dictionary, sort_keys=True).encode()).hexdigest()
+
 
 def load_game_update_states_from_s3() -> Dict[str, SingleGameUpdateState]:
     """Loads update state of all games from s3"""
@@ -59,14 +79,50 @@ def load_game_update_states_from_s3() -> Dict[str, SingleGameUpdateState]:
     logger.info(f"Loaded {len(json_data)} single game update states from s3.")
     return {key: SingleGameUpdateState(**value) for (key, value) in json_data.items()}
 
+
 def save_game_update_states_to_s3(
-    data: Dict[str, SingleGameUpdateState]
-) -> Dict[str, Dict[str, Any]]:
-    """Saves update state of all games to s3 and returns JSON form of saved data"""
+    data: Dict[str, SingleGameUpdateState],
+    previous_data: Optional[Dict[str, SingleGameUpdateState]] = None,
+) -> Dict[str, Any]:
+    """
+    Saves update state of all games to s3 if any game's state changed.
+
+    Args:
+        data: the update state of all games to save
+        previous_data: the update state as it was loaded from s3. If given, the write
+            is skipped when no game's content hash differs from its previous one.
+
+    Returns:
+        dictionary with whether s3 was written ("saved"), the games whose state was
+        added or changed ("games_written") or removed ("games_removed"), and the JSON
+        form of all of the data ("state")
+    """
+    previous_hashes: Dict[str, str] = {
+        name: value.content_hash for (name, value) in (previous_data or {}).items()
+    }
+    games_written: List[str] = [
+        name
+        for (name, value) in data.items()
+        if (previous_data is None)
+        or (previous_hashes.get(name) != value.content_hash)
+    ]
+    games_removed: List[str] = [name for name in previous_hashes if name not in data]
     json_data: Dict[str, Dict[str, Any]] = {
         name: value.dictionary for (name, value) in data.items()
     }
-    body: bytes = json.dumps(json_data).encode()
-    s3_client.put_object(Bucket=STORECHECKER_S3_BUCKET, Key=STATE_S3_KEY, Body=body)
-    logger.info(f"Saved {len(data)} single game update states to s3.")
-    return json_data
+    saved: bool = bool(games_written or games_removed) or (previous_data is None)
+    if saved:
+        body: bytes = json.dumps(json_data).encode()
+        s3_client.put_object(Bucket=STORECHECKER_S3_BUCKET, Key=STATE_S3_KEY, Body=body)
+        logger.info(
+            f"Saved {len(data)} single game update states to s3 "
+            f"({len(games_written)} written, {len(games_removed)} removed)."
+        )
+    else:
+        logger.info("No single game update state changed. Not saving to s3.")
+    return {
+        "saved": saved,
+        "games_written": games_written,
+        "games_removed": games_removed,
+        "state": json_data,
+    }
@@ -1,8 +1,10 @@
+import { Hit } from "../types/Hit";
 import { User, addSlugToUser, removeSlugFromUser } from "../types/User";
 
 type CheckSubscribeGame = {
   slug: string;
   title: string;
+  region: string;
 };
 
 type CheckSubscribeResponse = {
@@ -14,15 +16,44 @@ type SubscribeLambdaPayload = {
   type: string;
   subscriber: string;
   slug?: string;
+  region?: string;
+  target_price?: string;
 };
 
-async function invokeLambda(payload: SubscribeLambdaPayload): Promise<any> {
+type SearchLambdaPayload = {
+  type: "SEARCH";
+  query: string;
+  exact?: string;
+};
+
+type SearchResponse = {
+  type: string;
+  hits: Hit[];
+  cached: boolean;
+};
+
+async function invokeLambda(
+  payload: SubscribeLambdaPayload | SearchLambdaPayload
+): Promise<any> {
   const query: string = new URLSearchParams({ ...payload }).toString();
   const url: string = `${process.env.REACT_APP_SUBSCRIBE_LAMBDA_BASE_URL}?${query}`;
   const response: Response = await fetch(url);
   return await response.json();
 }
 
+export async function searchGames(
+  query: string,
+  exact: boolean = false
+): Promise<Hit[]> {
+  const response: SearchResponse = await invokeLambda({
+    type: "SEARCH",
+    query,
+    ...(exact ? { exact: "1" } : {}),
+  });
+  console.log(`Completed search! (cached: ${response.cached})`);
+  return response.hits;
+}
+
 export async function makeUser(email: string): Promise<User> {
   const response: CheckSubscribeResponse = await invokeLambda({
     type: "CHECK",
@@ -36,7 +67,8 @@ export async function makeUser(email: string): Promise<User> {
 
 export async function subscribeUserToSlug(
   user: User,
-  slug: string
+  slug: string,
+  targetPrice?: number
 ): Promise<User> {
   console.log(
     `subscribing user ${user.email} to price updates for game ${slug}`
@@ -46,6 +78,9 @@ export async function subscribeUserToSlug(
       type: "ADD",
       slug,
       subscriber: user.email,
+      ...(targetPrice === undefined
+        ? {}
+        : { target_price: targetPrice.toFixed(2) }),
     })
   );
   return addSlugToUser(user, slug);
@@ -7,6 +7,17 @@ locals {
     US_ALGOLIA_KEY       = "c4da8be7fd29f0f5bfa42920b0a99dc7"
     US_GAMES_INDEX_NAME  = "ncom_game_en_us_title_asc"
     SUBSCRIBE_URL_S3_KEY = "url_of_subscription_lambda.txt"
+    OUTBOX_S3_PREFIX     = "outbox/"
+    PROFILE_S3_PREFIX    = "profiles/"
+    # where emails that the SMTP server refused for good are moved to
+    OUTBOX_DEAD_LETTER_S3_PREFIX = "outbox_dead_letter/"
+    # bounds on how often each game's price is checked (see poll_scheduler.py)
+    MIN_POLL_INTERVAL_HOURS     = 3
+    MAX_POLL_INTERVAL_HOURS     = 48
+    INITIAL_POLL_INTERVAL_HOURS = 12
+    # regional eShops besides the US one, keyed by region name, each with
+    # algolia_id, algolia_key, games_index_name, and (optionally) request_budget
+    SHOP_REGIONS = {}
   }
 }
 
@@ -24,15 +35,32 @@ resource "aws_s3_object" "state" {
   content = jsonencode({})
 }
 
+resource "aws_s3_object" "send_ledger" {
+  bucket  = aws_s3_bucket.storechecker.bucket
+  key     = "send_ledger.json"
+  content = jsonencode([])
+}
+
+resource "aws_s3_object" "outbox_send_ledger" {
+  bucket  = aws_s3_bucket.storechecker.bucket
+  key     = "outbox_send_ledger.json"
+  content = jsonencode([])
+}
+
 module "store_checker_subscribe" {
   source         = "../LambdaWithLogging"
   function_name  = "store_checker_subscription"
   code_directory = local.code_directory
   file_manifest = [
+    "email_outbox.py",
     "game_shop_state.py",
     "get_logger.py",
     "link_formatter.py",
+    "profiling.py",
+    "search_cache.py",
     "send_email.py",
+    "send_ledger.py",
+    "shop_region.py",
     "subscriber_job.py",
     "subscriber_state.py",
     "subscribe_lambda_function.py",
@@ -41,14 +69,19 @@ module "store_checker_subscribe" {
   handler = "subscribe_lambda_function.lambda_handler"
   timeout = 10
   environment_variables = {
-    SENDER_ADDRESS         = local.lambda_variables.SENDER_INFO.SENDER_ADDRESS
-    SENDER_PASSWORD        = local.lambda_variables.SENDER_INFO.SENDER_PASSWORD
-    US_ALGOLIA_ID          = local.lambda_variables.US_ALGOLIA_ID
-    US_ALGOLIA_KEY         = local.lambda_variables.US_ALGOLIA_KEY
-    US_GAMES_INDEX_NAME    = local.lambda_variables.US_GAMES_INDEX_NAME
-    STORECHECKER_S3_BUCKET = aws_s3_bucket.storechecker.bucket
-    SUBSCRIBERS_S3_KEY     = aws_s3_object.subscribers.key
-    SUBSCRIBE_URL_S3_KEY   = local.lambda_variables.SUBSCRIBE_URL_S3_KEY
+    SENDER_ADDRESS               = local.lambda_variables.SENDER_INFO.SENDER_ADDRESS
+    SENDER_PASSWORD              = local.lambda_variables.SENDER_INFO.SENDER_PASSWORD
+    US_ALGOLIA_ID                = local.lambda_variables.US_ALGOLIA_ID
+    US_ALGOLIA_KEY               = local.lambda_variables.US_ALGOLIA_KEY
+    US_GAMES_INDEX_NAME          = local.lambda_variables.US_GAMES_INDEX_NAME
+    SHOP_REGIONS                 = jsonencode(local.lambda_variables.SHOP_REGIONS)
+    STORECHECKER_S3_BUCKET       = aws_s3_bucket.storechecker.bucket
+    PROFILE_S3_PREFIX            = local.lambda_variables.PROFILE_S3_PREFIX
+    SUBSCRIBERS_S3_KEY           = aws_s3_object.subscribers.key
+    SUBSCRIBE_URL_S3_KEY         = local.lambda_variables.SUBSCRIBE_URL_S3_KEY
+    OUTBOX_S3_PREFIX             = local.lambda_variables.OUTBOX_S3_PREFIX
+    OUTBOX_DEAD_LETTER_S3_PREFIX = local.lambda_variables.OUTBOX_DEAD_LETTER_S3_PREFIX
+    OUTBOX_SEND_LEDGER_S3_KEY    = aws_s3_object.outbox_send_ledger.key
   }
 }
 
@@ -70,7 +103,7 @@ resource "aws_s3_object" "subscribe_url" {
 }
 
 resource "aws_iam_policy" "store_checker_subscribe_s3" {
-  description = "Allows the store checker subscribe lambda to read and write the subscribers (and read its own URL!)"
+  description = "Allows the store checker subscribe lambda to read and write the subscribers, enqueue emails (and read its own URL!)"
   policy = jsonencode({
     Version = "2012-10-17"
     Statement = [
@@ -80,6 +113,18 @@ resource "aws_iam_policy" "store_checker_subscribe_s3" {
         Effect   = "Allow"
         Sid      = "ReadWriteState"
       },
+      {
+        Action   = "s3:PutObject"
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.PROFILE_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "WriteProfiles"
+      },
+      {
+        Action   = "s3:PutObject"
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.OUTBOX_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "EnqueueEmails"
+      },
       {
         Action   = "s3:GetObject"
         Resource = "${aws_s3_bucket.storechecker.arn}/${aws_s3_object.subscribe_url.key}"
@@ -103,7 +148,12 @@ module "store_checker_fulfill" {
     "game_shop_state.py",
     "get_logger.py",
     "link_formatter.py",
+    "poll_scheduler.py",
+    "profiling.py",
+    "search_cache.py",
     "send_email.py",
+    "send_ledger.py",
+    "shop_region.py",
     "subscriber_state.py",
     "update_job.py",
     "update_lambda_function.py",
@@ -113,20 +163,26 @@ module "store_checker_fulfill" {
   handler = "update_lambda_function.lambda_handler"
   timeout = 10
   environment_variables = {
-    SENDER_ADDRESS         = local.lambda_variables.SENDER_INFO.SENDER_ADDRESS
-    SENDER_PASSWORD        = local.lambda_variables.SENDER_INFO.SENDER_PASSWORD
-    US_ALGOLIA_ID          = local.lambda_variables.US_ALGOLIA_ID
-    US_ALGOLIA_KEY         = local.lambda_variables.US_ALGOLIA_KEY
-    US_GAMES_INDEX_NAME    = local.lambda_variables.US_GAMES_INDEX_NAME
-    STORECHECKER_S3_BUCKET = aws_s3_bucket.storechecker.bucket
-    STATE_S3_KEY           = aws_s3_object.state.key
-    SUBSCRIBERS_S3_KEY     = aws_s3_object.subscribers.key
-    SUBSCRIBE_LAMBDA_URL   = aws_lambda_function_url.subscribe_url.function_url
+    SENDER_ADDRESS              = local.lambda_variables.SENDER_INFO.SENDER_ADDRESS
+    SENDER_PASSWORD             = local.lambda_variables.SENDER_INFO.SENDER_PASSWORD
+    US_ALGOLIA_ID               = local.lambda_variables.US_ALGOLIA_ID
+    US_ALGOLIA_KEY              = local.lambda_variables.US_ALGOLIA_KEY
+    US_GAMES_INDEX_NAME         = local.lambda_variables.US_GAMES_INDEX_NAME
+    SHOP_REGIONS                = jsonencode(local.lambda_variables.SHOP_REGIONS)
+    STORECHECKER_S3_BUCKET      = aws_s3_bucket.storechecker.bucket
+    PROFILE_S3_PREFIX           = local.lambda_variables.PROFILE_S3_PREFIX
+    STATE_S3_KEY                = aws_s3_object.state.key
+    SEND_LEDGER_S3_KEY          = aws_s3_object.send_ledger.key
+    SUBSCRIBERS_S3_KEY          = aws_s3_object.subscribers.key
+    SUBSCRIBE_LAMBDA_URL        = aws_lambda_function_url.subscribe_url.function_url
+    MIN_POLL_INTERVAL_HOURS     = local.lambda_variables.MIN_POLL_INTERVAL_HOURS
+    MAX_POLL_INTERVAL_HOURS     = local.lambda_variables.MAX_POLL_INTERVAL_HOURS
+    INITIAL_POLL_INTERVAL_HOURS = local.lambda_variables.INITIAL_POLL_INTERVAL_HOURS
   }
 }
 
 resource "aws_iam_policy" "store_checker_fulfillment_s3" {
-  description = "Allows the store checker fulfillment lambda to read and write to the state and read the subscribers"
+  description = "Allows the store checker fulfillment lambda to read and write to the state and send ledger and read the subscribers"
   policy = jsonencode({
     Version = "2012-10-17"
     Statement = [
@@ -136,6 +192,18 @@ resource "aws_iam_policy" "store_checker_fulfillment_s3" {
         Effect   = "Allow"
         Sid      = "ReadWriteState"
       },
+      {
+        Action   = ["s3:PutObject", "s3:GetObject"]
+        Resource = "${aws_s3_bucket.storechecker.arn}/${aws_s3_object.send_ledger.key}"
+        Effect   = "Allow"
+        Sid      = "ReadWriteSendLedger"
+      },
+      {
+        Action   = "s3:PutObject"
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.PROFILE_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "WriteProfiles"
+      },
       {
         Action   = "s3:GetObject"
         Resource = "${aws_s3_bucket.storechecker.arn}/${aws_s3_object.subscribers.key}"
@@ -151,14 +219,14 @@ resource "aws_iam_role_policy_attachment" "store_checker_fulfillment_s3_attachme
   policy_arn = aws_iam_policy.store_checker_fulfillment_s3.arn
 }
 
-resource "aws_cloudwatch_event_rule" "twice_a_day" {
-  name                = "TwiceADay"
-  description         = "Fires at midnight and 6 PM UTC (11 AM and 5 PM MT) every day."
-  schedule_expression = "cron(0 0,18 * * ? *)"
+resource "aws_cloudwatch_event_rule" "hourly" {
+  name                = "Hourly"
+  description         = "Fires at the top of every hour. Each run only checks games that are due."
+  schedule_expression = "cron(0 * * * ? *)"
 }
 
-resource "aws_cloudwatch_event_target" "run_storechecker_twice_a_day" {
-  rule      = aws_cloudwatch_event_rule.twice_a_day.name
+resource "aws_cloudwatch_event_target" "run_storechecker_hourly" {
+  rule      = aws_cloudwatch_event_rule.hourly.name
   target_id = "lambda"
   arn       = module.store_checker_fulfill.function.arn
 }
@@ -168,5 +236,98 @@ resource "aws_lambda_permission" "allow_cloudwatch_to_call_storechecker" {
   action        = "lambda:InvokeFunction"
   function_name = module.store_checker_fulfill.function.function_name
   principal     = "events.amazonaws.com"
-  source_arn    = aws_cloudwatch_event_rule.twice_a_day.arn
+  source_arn    = aws_cloudwatch_event_rule.hourly.arn
+}
+
+module "store_checker_outbox" {
+  source         = "../LambdaWithLogging"
+  function_name  = "store_checker_outbox"
+  code_directory = local.code_directory
+  file_manifest = [
+    "drain_outbox_lambda_function.py",
+    "email_outbox.py",
+    "get_logger.py",
+    "profiling.py",
+    "send_email.py",
+    "send_ledger.py",
+  ]
+  runtime = local.lambda_runtime
+  handler = "drain_outbox_lambda_function.lambda_handler"
+  timeout = 50
+  environment_variables = {
+    SENDER_ADDRESS               = local.lambda_variables.SENDER_INFO.SENDER_ADDRESS
+    SENDER_PASSWORD              = local.lambda_variables.SENDER_INFO.SENDER_PASSWORD
+    STORECHECKER_S3_BUCKET       = aws_s3_bucket.storechecker.bucket
+    PROFILE_S3_PREFIX            = local.lambda_variables.PROFILE_S3_PREFIX
+    OUTBOX_S3_PREFIX             = local.lambda_variables.OUTBOX_S3_PREFIX
+    OUTBOX_DEAD_LETTER_S3_PREFIX = local.lambda_variables.OUTBOX_DEAD_LETTER_S3_PREFIX
+    OUTBOX_SEND_LEDGER_S3_KEY    = aws_s3_object.outbox_send_ledger.key
+  }
+}
+
+resource "aws_iam_policy" "store_checker_outbox_s3" {
+  description = "Allows the store checker outbox lambda to list, read, rewrite, and delete enqueued emails, to write dead letters, and to read and write its send ledger"
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action   = "s3:ListBucket"
+        Resource = aws_s3_bucket.storechecker.arn
+        Effect   = "Allow"
+        Sid      = "ListOutbox"
+        Condition = {
+          StringLike = { "s3:prefix" = "${local.lambda_variables.OUTBOX_S3_PREFIX}*" }
+        }
+      },
+      {
+        Action   = "s3:PutObject"
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.PROFILE_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "WriteProfiles"
+      },
+      {
+        Action   = ["s3:GetObject", "s3:PutObject", "s3:DeleteObject"]
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.OUTBOX_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "ReadWriteDeleteOutbox"
+      },
+      {
+        Action   = "s3:PutObject"
+        Resource = "${aws_s3_bucket.storechecker.arn}/${local.lambda_variables.OUTBOX_DEAD_LETTER_S3_PREFIX}*"
+        Effect   = "Allow"
+        Sid      = "WriteDeadLetters"
+      },
+      {
+        Action   = ["s3:PutObject", "s3:GetObject"]
+        Resource = "${aws_s3_bucket.storechecker.arn}/${aws_s3_object.outbox_send_ledger.key}"
+        Effect   = "Allow"
+        Sid      = "ReadWriteOutboxSendLedger"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "store_checker_outbox_s3_attachment" {
+  role       = module.store_checker_outbox.execution_role.name
+  policy_arn = aws_iam_policy.store_checker_outbox_s3.arn
+}
+
+resource "aws_cloudwatch_event_rule" "every_minute" {
+  name                = "EveryMinute"
+  description         = "Fires every minute to deliver enqueued emails."
+  schedule_expression = "rate(1 minute)"
+}
+
+resource "aws_cloudwatch_event_target" "drain_outbox_every_minute" {
+  rule      = aws_cloudwatch_event_rule.every_minute.name
+  target_id = "lambda"
+  arn       = module.store_checker_outbox.function.arn
+}
+
+resource "aws_lambda_permission" "allow_cloudwatch_to_call_outbox" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = module.store_checker_outbox.function.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.every_minute.arn
 }